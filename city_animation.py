@@ -0,0 +1,110 @@
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+import city_generator
+from city_tiles import writePngChunk, pngScanlines
+
+
+def changedBounds(dirtyRects):
+    # one (x, y, w, h) box around everything a tick repainted, a single pixel if nothing changed
+    if not dirtyRects:
+        return 0, 0, 1, 1
+    x0 = min(x for x, _, _, _ in dirtyRects)
+    y0 = min(y for _, y, _, _ in dirtyRects)
+    x1 = max(x + w for x, _, w, _ in dirtyRects)
+    y1 = max(y + h for _, y, _, h in dirtyRects)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def animationRegions(animator, frameCount):
+    # the full first frame, then only the box each tick changed
+    yield 0, 0, animator.frame
+
+    for _ in range(frameCount - 1):
+        x, y, regionWidth, regionHeight = changedBounds(animator.tick())
+        yield x, y, animator.frame[y:y + regionHeight, x:x + regionWidth]
+
+
+def writeApng(animator, file, frameCount, fps=city_generator.animationFps, compressLevel=6):
+    # palette apng written as it's animated, later frames only store the region that changed and are drawn over the last
+    w, h = animator.size
+    file.write(b"\x89PNG\r\n\x1a\n")
+    writePngChunk(file, b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 3, 0, 0, 0))
+    writePngChunk(file, b"acTL", struct.pack(">II", frameCount, 0))  # loops forever
+    writePngChunk(file, b"PLTE", bytes(animator.palette))
+
+    sequence = 0
+    for frameIndex, (x, y, region) in enumerate(animationRegions(animator, frameCount)):
+        regionHeight, regionWidth = region.shape
+        # dispose op 0 keeps the frame on the canvas, blend op 0 replaces the pixels under it
+        writePngChunk(file, b"fcTL", struct.pack(">IIIIIHHBB", sequence, regionWidth, regionHeight, x, y, 1, fps, 0, 0))
+        sequence += 1
+
+        data = zlib.compress(pngScanlines(region), compressLevel)
+        if frameIndex == 0:
+            writePngChunk(file, b"IDAT", data)
+        else:
+            writePngChunk(file, b"fdAT", struct.pack(">I", sequence) + data)
+            sequence += 1
+
+    writePngChunk(file, b"IEND", b"")
+
+
+def writeGif(animator, file, frameCount, fps=city_generator.animationFps):
+    # every frame shares the scene palette as the global colour table, later frames only store the region that changed
+    w, h = animator.size
+    file.write(b"GIF89a" + struct.pack("<HHBBB", w, h, 0xF7, 0, 0) + bytes(animator.palette))
+    file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")  # loops forever
+
+    for x, y, region in animationRegions(animator, frameCount):
+        regionImage = Image.frombuffer("P", (region.shape[1], region.shape[0]), np.ascontiguousarray(region), "raw", "P", 0, 1)
+        # disposal 1 leaves each frame in place for the next one to be drawn over
+        for data in GifImagePlugin.getdata(regionImage, offset=(x, y), duration=1000 / fps, disposal=1):
+            file.write(data)
+
+    file.write(b";")
+
+
+def exportAnimation(animator, filename, frameCount=48, fps=city_generator.animationFps):
+    # the format comes from the extension, .gif or .png (apng)
+    startTime = time.perf_counter()
+    with open(filename, "wb") as file:
+        if filename.lower().endswith(".gif"):
+            writeGif(animator, file, frameCount, fps)
+        else:
+            writeApng(animator, file, frameCount, fps)
+
+    return {
+        'filename': filename,
+        'frames': frameCount,
+        'bytes': os.path.getsize(filename),
+        'seconds': time.perf_counter() - startTime,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a city skyline with flickering windows as an APNG or GIF.")
+    parser.add_argument("--width", type=int, default=city_generator.width)
+    parser.add_argument("--height", type=int, default=city_generator.height)
+    parser.add_argument("--seed", type=int, default=None, help="seed for the scene, random if not given")
+    parser.add_argument("--frames", type=int, default=48)
+    parser.add_argument("--fps", type=int, default=city_generator.animationFps)
+    parser.add_argument("--output", default="exports/city_animated.png", help=".png for apng or .gif")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    animator = city_generator.WindowAnimator(city_generator.CityRenderer(args.seed), args.width, args.height)
+    result = exportAnimation(animator, args.output, args.frames, args.fps)
+    print(f"Exported {result['frames']} frames to {result['filename']} ({result['bytes']} bytes) "
+          f"in {result['seconds']:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
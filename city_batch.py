@@ -0,0 +1,62 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import city_generator
+
+
+def imageSeed(baseSeed, index):
+    # each image gets its own seed so any single image can be re-rendered on its own
+    return baseSeed + index
+
+
+def renderSeededCity(w, h, seed):
+    # a fresh renderer per image keeps a worker's previous image from leaking into the next one
+    return city_generator.CityRenderer(seed).generateCityImage(w, h)
+
+
+def renderBatchImage(job):
+    w, h, seed, outputDir = job
+    img = renderSeededCity(w, h, seed)
+    filename = os.path.join(outputDir, f"city_{seed}.png")
+    img.save(filename)
+    return filename
+
+
+def renderBatch(count, w, h, baseSeed=0, outputDir="exports", workers=None):
+    os.makedirs(outputDir, exist_ok=True)
+
+    jobs = [(w, h, imageSeed(baseSeed, i), outputDir) for i in range(count)]
+    workers = workers or os.cpu_count() or 1
+    chunkSize = max(1, count // (workers * 4))
+
+    startTime = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        filenames = list(pool.map(renderBatchImage, jobs, chunksize=chunkSize))
+    elapsed = time.perf_counter() - startTime
+
+    return {
+        'filenames': filenames,
+        'count': count,
+        'seconds': elapsed,
+        'imagesPerSecond': count / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render city skylines headlessly across multiple processes.")
+    parser.add_argument("--count", type=int, default=100, help="number of images to render")
+    parser.add_argument("--width", type=int, default=city_generator.width)
+    parser.add_argument("--height", type=int, default=city_generator.height)
+    parser.add_argument("--seed", type=int, default=0, help="base seed, image i uses seed + i")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (defaults to the cpu count)")
+    parser.add_argument("--output", default="exports", help="directory the PNGs are written to")
+    args = parser.parse_args(argv)
+
+    result = renderBatch(args.count, args.width, args.height, args.seed, args.output, args.workers)
+    print(f"Rendered {result['count']} images in {result['seconds']:.2f}s ({result['imagesPerSecond']:.1f} images/s)")
+
+
+if __name__ == "__main__":
+    main()
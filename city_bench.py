@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# benchmarks run headless, pygame only needs a dummy display to make surfaces
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+import city_generator
+import city_gui
+import city_pan
+
+benchmarkSeed = 1234
+renderSizes = [(600, 400), (1920, 1080), (3840, 2160), (7680, 4320)]
+quickRenderSizes = [(600, 400), (1920, 1080)]
+layoutWidths = [1920, 7680]
+
+
+def timeCall(run, setup=None, repeats=7, minSeconds=0.2, maxSeconds=10.0):
+    # times run() at least `repeats` times and for at least minSeconds, setup() isn't timed and its
+    # return value is passed to run so every run can start from the same state
+    times = []
+    startTime = time.perf_counter()
+
+    while len(times) < repeats or time.perf_counter() - startTime < minSeconds:
+        state = setup() if setup is not None else None
+        runStart = time.perf_counter()
+        run(state) if setup is not None else run()
+        times.append(time.perf_counter() - runStart)
+
+        if time.perf_counter() - startTime > maxSeconds and len(times) >= 3:
+            break
+
+    return {'median': statistics.median(times), 'min': min(times), 'runs': len(times)}
+
+
+def seededRenderer():
+    return city_generator.CityRenderer(benchmarkSeed)
+
+
+def layoutBenchmarks():
+    benchmarks = {}
+    for w in layoutWidths:
+        benchmarks[f"layout/generate/{w}"] = (
+            lambda w=w: seededRenderer().generateBuildingsData(w, city_generator.absoluteMaxBuildingHeight), None)
+
+    def extendSetup():
+        renderer = seededRenderer()
+        return renderer, renderer.generateBuildingsData(1920, city_generator.absoluteMaxBuildingHeight)
+
+    def extend(state):
+        renderer, buildingsData = state
+        renderer.extendBuildingsData(buildingsData, 1920, 7680, city_generator.absoluteMaxBuildingHeight)
+
+    benchmarks["layout/extend/1920-7680"] = (extend, extendSetup)
+    return benchmarks
+
+
+def windowBenchmarks():
+    # one 100px wide building 300px tall per style, its lit windows are decided on the first run and reused after
+    benchmarks = {}
+    color = (60, 70, 90)
+
+    for styleIndex, windowStyle in enumerate(city_generator.windowStyles):
+        for canvasName in ("pillow", "array"):
+            renderer = seededRenderer()
+            renderer.buildingsData = [city_generator.BuildingLayer()]
+            renderer.buildingsData[0].append(10, 100, 300, 10)
+            renderer.buildingsData[0].style[0] = styleIndex
+
+            if canvasName == "pillow":
+                draw = ImageDraw.Draw(Image.new("RGB", (120, 400)))
+            else:
+                draw = city_generator.ArrayCanvas(120, 400)
+
+            def drawStyle(renderer=renderer, draw=draw):
+                renderer.drawWindows(draw, 10, 100, 100, 300, color, 0, 0)
+
+            benchmarks[f"windows/{windowStyle}/{canvasName}"] = (drawStyle, None)
+    return benchmarks
+
+
+def skyBenchmarks():
+    renderer = seededRenderer()
+    renderer.updateScene(3840, 2160)
+    skyColor, h = renderer.skyColor, 2160
+
+    img = Image.new("RGB", (3840, h))
+    draw = ImageDraw.Draw(img)
+    canvas = city_generator.ArrayCanvas(3840, h, None, "P")
+
+    return {
+        "sky/gradient/2160": (lambda: city_generator.skyGradient.__wrapped__(skyColor, h), None),
+        "sky/draw/3840x2160/rgb": (lambda: renderer.drawSky(draw, 3840, h), None),
+        "sky/draw/3840x2160/indexed": (lambda: renderer.drawSky(canvas, 3840, h, indexed=True), None),
+    }
+
+
+def renderBenchmarks(sizes):
+    # a fresh seeded renderer per run, so every run lays out and draws the whole scene
+    benchmarks = {}
+    for w, h in sizes:
+        benchmarks[f"render/{w}x{h}"] = (lambda state, w=w, h=h: state.generateCityImage(w, h), seededRenderer)
+        benchmarks[f"thumbnails/{w}x{h}"] = (lambda state, w=w, h=h: state.thumbnailPyramid(w, h), seededRenderer)
+    return benchmarks
+
+
+def conversionBenchmarks(sizes):
+    benchmarks = {}
+    for w, h in sizes:
+        renderer = seededRenderer()
+        img = renderer.generateCityImage(w, h)
+        pixels, palette = renderer.generateCityPixels(w, h)
+        benchmarks[f"convert/pillow/{w}x{h}"] = (lambda img=img: city_gui.convertPillowToPygame(img), None)
+        benchmarks[f"convert/pixels/{w}x{h}"] = (
+            lambda pixels=pixels, palette=palette: city_gui.convertPixelsToPygame(pixels, palette), None)
+    return benchmarks
+
+
+def panBenchmarks():
+    # four seconds of 30 fps camera pan, every strip rendered and every frame sliced
+    def run():
+        for _ in city_pan.panFrames(seededRenderer(), 1280, 720, 120, 4.0):
+            pass
+
+    return {"pan/1280x720/120frames": (run, None)}
+
+
+def startupBenchmarks():
+    # every run starts a new interpreter, so these are cold starts up to the first render and the window's first frame
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def launch(*args):
+        return lambda: subprocess.run([sys.executable, *args], cwd=here, check=True,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return {
+        "startup/import": (launch("-c", "import city_generator"), None),
+        "startup/first-render/600x400": (launch("-c", "import city_generator; city_generator.generateCityImage(600, 400)"), None),
+        "startup/first-frame": (launch("city_gui.py", "--startup-time"), None),
+    }
+
+
+def exportBenchmarks(directory):
+    img = seededRenderer().generateCityImage(1920, 1080)
+    return {
+        "export/png/1920x1080": (lambda: city_generator.exportImage(img, "png", directory=directory), None),
+        "export/webp/1920x1080": (lambda: city_generator.exportImage(img, "webp", directory=directory), None),
+        "upscale/4x/1920x1080": (lambda: city_generator.upscaleImage(img, 4), None),
+    }
+
+
+def runBenchmarks(quick=False, nameFilter=None, log=print):
+    sizes = quickRenderSizes if quick else renderSizes
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = {}
+        benchmarks.update(layoutBenchmarks())
+        benchmarks.update(windowBenchmarks())
+        benchmarks.update(skyBenchmarks())
+        benchmarks.update(renderBenchmarks(sizes))
+        benchmarks.update(conversionBenchmarks(sizes))
+        benchmarks.update(exportBenchmarks(directory))
+        benchmarks.update(panBenchmarks())
+        benchmarks.update(startupBenchmarks())
+
+        for name, (run, setup) in benchmarks.items():
+            if nameFilter and nameFilter not in name:
+                continue
+            results[name] = timeCall(run, setup, repeats=3 if quick else 7, minSeconds=0.05 if quick else 0.2)
+            log(f"{name:40s} {results[name]['median'] * 1000:10.3f} ms  ({results[name]['runs']} runs)")
+
+    return {
+        'meta': {
+            'seed': benchmarkSeed,
+            'quick': quick,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'vectorizedWindows': city_generator.vectorizedWindows,
+        },
+        'results': results,
+    }
+
+
+def compareResults(current, baseline, threshold):
+    # benchmarks whose fastest run got more than threshold (a fraction) slower than the baseline's,
+    # the fastest run is compared because it's the one least disturbed by whatever else the machine is doing
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None or previous['min'] <= 0:
+            continue
+        ratio = result['min'] / previous['min']
+        if ratio > 1 + threshold:
+            regressions.append((name, previous['min'], result['min'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the city generator headlessly with fixed seeds.")
+    parser.add_argument("--output", default="benchmarks.json", help="where the results are written")
+    parser.add_argument("--baseline", default=None, help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown fraction counted as a regression")
+    parser.add_argument("--quick", action="store_true", help="fewer runs and only the smaller canvas sizes")
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--vectorized", action="store_true", help="draw with numpy array canvases")
+    args = parser.parse_args(argv)
+
+    city_generator.vectorizedWindows = args.vectorized
+    current = runBenchmarks(args.quick, args.filter)
+
+    with open(args.output, "w") as file:
+        json.dump(current, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+
+    regressions = compareResults(current, baseline, args.threshold)
+    for name, before, after, ratio in regressions:
+        print(f"REGRESSION {name}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms ({ratio:.2f}x)")
+    if not regressions:
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
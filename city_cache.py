@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import city_generator
+
+cacheVersion = 1  # bump when a change to the generator makes old cached images wrong
+cacheMemoryBytes = 256 * 1024 * 1024
+cacheDiskBytes = 2 * 1024 * 1024 * 1024
+cacheFormats = ["png", "webp", "raw"]  # raw is headerless rgb rows
+
+
+def sceneKey(seed, w, h, imageFormat="png", compressLevel=6):
+    # a hash of everything that changes the cached bytes, written out with sorted keys so equal parameters
+    # always give the same key
+    params = {
+        'version': cacheVersion,
+        'seed': seed,
+        'width': w,
+        'height': h,
+        'format': imageFormat,
+        'compressLevel': compressLevel if imageFormat != "raw" else None,
+        'vectorizedWindows': city_generator.vectorizedWindows,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def renderSceneBytes(seed, w, h, imageFormat="png", compressLevel=6):
+    img = city_generator.CityRenderer(seed).generateCityImage(w, h)
+    if imageFormat == "raw":
+        return img.convert("RGB").tobytes()
+    return bytes(city_generator.encodeImage(img, imageFormat, compressLevel))
+
+
+class RenderCache:
+    # rendered scenes as encoded bytes, most recently used kept in memory and, with a directory, on disk too.
+    # each tier evicts its least recently used entries once it's over its byte budget
+    def __init__(self, memoryBytes=cacheMemoryBytes, directory=None, diskBytes=cacheDiskBytes):
+        self.memoryBytes = memoryBytes
+        self.directory = directory
+        self.diskBytes = diskBytes
+        self.memory = OrderedDict()  # key -> bytes, oldest first
+        self.memoryUsed = 0
+        self.disk = OrderedDict()  # key -> file size, oldest first
+        self.diskUsed = 0
+        self.stats = {'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'memoryEvictions': 0, 'diskEvictions': 0}
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # files are touched when they're used, so their modification times carry the order over restarts
+            entries = []
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith(".cache"):
+                    info = entry.stat()
+                    entries.append((info.st_mtime, entry.name[:-len(".cache")], info.st_size))
+            for _, key, size in sorted(entries):
+                self.disk[key] = size
+                self.diskUsed += size
+            self.evictDisk()
+
+    def diskPath(self, key):
+        return os.path.join(self.directory, f"{key}.cache")
+
+    def get(self, key):
+        # the cached bytes for key, or None
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.stats['memoryHits'] += 1
+                return data
+            onDisk = key in self.disk
+
+        if onDisk:
+            try:
+                with open(self.diskPath(key), "rb") as file:
+                    data = file.read()
+                os.utime(self.diskPath(key))
+            except FileNotFoundError:
+                data = None
+
+        with self.lock:
+            if data is None:
+                if key in self.disk:
+                    self.diskUsed -= self.disk.pop(key)
+                self.stats['misses'] += 1
+                return None
+
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self.stats['diskHits'] += 1
+            self.storeMemory(key, data)
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            self.storeMemory(key, data)
+
+        if self.directory is None or len(data) > self.diskBytes:
+            return
+
+        # written to a temporary file first so a reader never sees half a file
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temporary, self.diskPath(key))
+
+        with self.lock:
+            self.diskUsed += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            self.evictDisk()
+
+    def storeMemory(self, key, data):
+        # called with the lock held, an entry bigger than the whole budget isn't kept
+        self.memoryUsed -= len(self.memory.pop(key, b""))
+        if len(data) > self.memoryBytes:
+            return
+
+        self.memory[key] = data
+        self.memoryUsed += len(data)
+        while self.memoryUsed > self.memoryBytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memoryUsed -= len(evicted)
+            self.stats['memoryEvictions'] += 1
+
+    def evictDisk(self):
+        # called with the lock held, or before the cache is shared
+        while self.diskUsed > self.diskBytes:
+            key, size = self.disk.popitem(last=False)
+            self.diskUsed -= size
+            self.stats['diskEvictions'] += 1
+            try:
+                os.remove(self.diskPath(key))
+            except FileNotFoundError:
+                pass
+
+    def render(self, seed, w, h, imageFormat="png", compressLevel=6):
+        # the encoded scene, straight from the cache when it's been rendered before so neither the layout nor
+        # the drawing runs again
+        key = sceneKey(seed, w, h, imageFormat, compressLevel)
+        data = self.get(key)
+        if data is None:
+            data = renderSceneBytes(seed, w, h, imageFormat, compressLevel)
+            self.put(key, data)
+        return data
+
+    def statistics(self):
+        with self.lock:
+            lookups = self.stats['memoryHits'] + self.stats['diskHits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                hits=self.stats['memoryHits'] + self.stats['diskHits'],
+                hitRate=(lookups - self.stats['misses']) / lookups if lookups else 0.0,
+                memoryEntries=len(self.memory),
+                memoryBytes=self.memoryUsed,
+                diskEntries=len(self.disk),
+                diskBytes=self.diskUsed,
+            )
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memoryUsed = 0
+            for key in self.disk:
+                try:
+                    os.remove(self.diskPath(key))
+                except FileNotFoundError:
+                    pass
+            self.disk.clear()
+            self.diskUsed = 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render seeded city skylines through the render cache.")
+    parser.add_argument("seeds", type=int, nargs="+", help="seeds to render, repeats are served from the cache")
+    parser.add_argument("--width", type=int, default=city_generator.width)
+    parser.add_argument("--height", type=int, default=city_generator.height)
+    parser.add_argument("--format", choices=cacheFormats, default="png")
+    parser.add_argument("--cache-dir", default="cache", help="directory for the on-disk tier")
+    parser.add_argument("--memory-mb", type=int, default=cacheMemoryBytes // (1024 * 1024))
+    parser.add_argument("--disk-mb", type=int, default=cacheDiskBytes // (1024 * 1024))
+    parser.add_argument("--output-dir", default=None, help="also write every image here")
+    args = parser.parse_args(argv)
+
+    cache = RenderCache(args.memory_mb * 1024 * 1024, args.cache_dir, args.disk_mb * 1024 * 1024)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    for seed in args.seeds:
+        startTime = time.perf_counter()
+        data = cache.render(seed, args.width, args.height, args.format)
+        print(f"seed {seed}: {len(data)} bytes in {(time.perf_counter() - startTime) * 1000:.1f} ms", file=sys.stderr)
+        if args.output_dir:
+            with open(os.path.join(args.output_dir, f"city_{seed}.{args.format}"), "wb") as file:
+                file.write(data)
+
+    print(json.dumps(cache.statistics()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
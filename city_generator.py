@@ -1,9 +1,18 @@
-﻿import pygame
-import random
+﻿import random
+from array import array
+from bisect import bisect_left, bisect_right
+import numpy as np
 from PIL import Image, ImageDraw
 import colorsys
+from functools import lru_cache, wraps
 import os
+import io
+import time
 import datetime
+import threading
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 
 # constants
@@ -16,6 +25,9 @@ maxBuildingHeight = height - minTopClearance - 120
 absoluteMaxBuildingHeight = 200  # hard maximum for any building height, prevents buildings from being too tall on resize
 buildingWidthRange = (40, 100)
 litWindowRate = 0.4
+windowStyles = ["normal", "wide", "tall", "tall-inverse"]
+windowStyleWeights = [0.8, 0.02, 0.18, 0.09]
+vectorizedWindows = False  # stamp windows with numpy array operations instead of one draw.rectangle per window
 
 roofLightChance = 0.2  # chance of a building having roof lights
 roofLightColors = [(255, 0, 0), (0, 255, 0), (255, 255, 0)]  # red, green, yellow
@@ -23,29 +35,25 @@ roofLightSize = 3
 roofLightSpacing = 12
 roofLightHeight = 1  # height above building roof
 skyBrightnessDarkThreshold = 0.45  # threshold below which sky is considered "dark" enough for roof lights
+lodWindowScale = 1 / 3  # below this scale windows would be under 2px, so each building's are drawn as one averaged fill
+occlusionNone = 1 << 30  # cover row of a column no nearer building reaches
+windowBitsDeadShare = 0.5  # a layer's packed window buffer is compacted once more than this share of it is left behind
 
-originalSkyHsl = None
-originalSkyColor = None
-originalBuildingColors = None
-originalBuildingsData = []
-originalMaxBuildingHeight = maxBuildingHeight
-windowsData = {}  # store window data for each building
-currentRoofLightColor = None
-isSkyDark = False  # track if sky is dark enough for roof lights
+maxFrameRate = 60  # the window never repaints faster than this
+resizeSettleTime = 150  # ms a window drag has to pause for before the city is regenerated at the new size
 
+exportFormat = "png"  # "png", or "webp" for lossless webp
+exportCompressLevel = 6  # 0-9, zlib level for png and effort for webp
+exportOptimize = False  # slower, smaller files
+exportWorkers = 2
+exportScales = None  # e.g. [1, 2, 4, 8] to write whole number upscales of every export for hidpi screens and print
 
-def generateSkyColor():
-    global isSkyDark
-    
-    hue = random.uniform(0, 1)
-    saturation = random.uniform(0.1, 0.3)
-    brightness = random.uniform(0.2, 0.9)
-    
-    isSkyDark = brightness < skyBrightnessDarkThreshold
+flickerRate = 0.002  # share of all windows switched on or off per animation tick
+roofLightBlinkTicks = (4, 12)  # fewest and most ticks a roof light stays on or off for
+animationFps = 8
 
-    r, g, b = colorsys.hls_to_rgb(hue, brightness, saturation)
-    
-    return (hue, saturation, brightness), (int(r * 255), int(g * 255), int(b * 255))
+# every finished render is logged here as one line of json, at info level
+renderLog = logging.getLogger("city_generator.render")
 
 
 def generateBuildingColors(hue, saturation, skyBrightness):
@@ -62,31 +70,7 @@ def generateBuildingColors(hue, saturation, skyBrightness):
     return colors
 
 
-def drawWindows(draw, x, yTop, width, totalHeight, buildingColor, layerIndex, buildingId=None):
-    global windowsData
-    
-    # if none is provided, generate a building id - stores roof lights and window data for each building
-    if buildingId is None:
-        buildingId = f"b_{x}_{yTop}_{width}_{totalHeight}_{layerIndex}"
-    
-    # if building already has window data, use it. otherwise create a new object
-    if buildingId in windowsData:
-        windowInfo = windowsData[buildingId]
-        windowStyle = windowInfo['style']
-        windowPositions = windowInfo['positions']
-    else:
-        windowStyle = random.choices( 
-            ["normal", "wide", "tall", "tall-inverse"], 
-            weights=[0.8, 0.02, 0.18, 0.09], 
-            k=1
-        )[0]
-        
-        windowPositions = []
-        windowsData[buildingId] = {
-            'style': windowStyle,
-            'positions': windowPositions
-        }
-    
+def windowColors(buildingColor, layerIndex):
     # calculate lit and unlit window colours based on building color
     r, g, b = buildingColor
     h, l, s = colorsys.rgb_to_hls(r / 255, g / 255, b / 255)
@@ -103,576 +87,1643 @@ def drawWindows(draw, x, yTop, width, totalHeight, buildingColor, layerIndex, bu
 
     windowColorOn = (int(wrOn * 255), int(wgOn * 255), int(wbOn * 255))
     windowColorOff = (int(wrOff * 255), int(wgOff * 255), int(wbOff * 255))
-    
+    return windowColorOn, windowColorOff
+
+
+# palette indices used for palette-indexed renders: the roof lights, then body/lit/unlit
+# window for each layer, then the solid sky followed by every gradient band
+roofLightIndex = 0
+skyPaletteIndex = 1 + numLayers * 3
+maxSkyBands = 256 - skyPaletteIndex
+
+
+def layerPaletteIndex(layerIndex):
+    return 1 + layerIndex * 3
+
+
+@lru_cache(maxsize=64)
+def skyBandRows(h):
+    # (yStart, yEnd) of the solid lower sky followed by each gradient band above it, only depends on the height
+    gradient_start_y = int(h * 0.25)  # sky gradient start point
+    rows = [(gradient_start_y, h)]
+
+    gradient_height = gradient_start_y
+    num_bands = max(1, gradient_height // 20)  # increase for less gradient bands
+    band_height = gradient_height / num_bands
+
+    for band in range(int(num_bands)):
+        y_start = int(gradient_start_y - (band + 1) * band_height)
+        y_end = int(gradient_start_y - band * band_height)
+        rows.append((max(0, y_start), max(0, y_end)))
+
+    return tuple(rows)
+
+
+@lru_cache(maxsize=64)
+def skyGradient(skyColor, h):
+    # (colour, yStart, yEnd) for the solid lower sky followed by each darker band above it
+    base_r, base_g, base_b = skyColor
+    base_h, base_l, base_s = colorsys.rgb_to_hls(base_r / 255, base_g / 255, base_b / 255)
+
+    darker_l = max(0.0, base_l * 0.8)  # darkest gradient point
+    darker_r, darker_g, darker_b = colorsys.hls_to_rgb(base_h, darker_l, base_s)
+    darker_color = (int(darker_r * 255), int(darker_g * 255), int(darker_b * 255))
+
+    rows = skyBandRows(h)
+    bands = [(skyColor,) + rows[0]]
+    num_bands = len(rows) - 1
+
+    for band in range(num_bands):
+        ratio = band / (num_bands - 1) if num_bands > 1 else 0
+
+        #decrease the r,g,b value
+        r = int(base_r + (darker_color[0] - base_r) * ratio) 
+        g = int(base_g + (darker_color[1] - base_g) * ratio)
+        b = int(base_b + (darker_color[2] - base_b) * ratio)
+
+        bands.append(((r, g, b),) + rows[band + 1])
+
+    return tuple(bands)
+
+
+def checkIndexedHeight(renderer, h, what):
+    # palette renders give every gradient band its own index, a sky with more bands than the palette has room for can't be drawn that way
+    if len(skyGradient(renderer.skyColor, h)) > maxSkyBands:
+        raise ValueError(f"a {h}px tall sky has too many gradient bands {what}")
+
+
+@lru_cache(maxsize=64)
+def skyIndexStrip(h):
+    # one column of the palette-indexed sky, ready to be stretched across a canvas
+    strip = np.empty(h, dtype=np.uint8)
+    for band, (yStart, yEnd) in enumerate(skyBandRows(h)):
+        strip[yStart:yEnd + 1] = skyPaletteIndex + band
+    strip.flags.writeable = False
+    return strip
+
+
+def fillRegion(region, color):
+    # broadcasting a 3 byte colour over every pixel is slow, so fill one row and copy it down
+    region[0] = color
+    region[1:] = region[0]
+
+
+class ArrayCanvas:
+    # numpy backed stand-in for ImageDraw, rectangles follow pillow's rules (truncated coords, inclusive, clipped)
+    def __init__(self, w, h, color=(0, 0, 0), mode="RGB", origin=(0, 0), scale=1):
+        # "RGB" canvases hold colours, "P" canvases hold one palette index per pixel
+        self.mode = mode
+        # scene coordinate of the top left pixel, so a canvas can be a window onto a much bigger scene
+        self.origin = origin
+        # canvas pixels per scene pixel, everything drawn is scaled by it
+        self.scale = scale
+        shape = (h, w, 3) if mode == "RGB" else (h, w)
+
+        # like Image.new, a color of None leaves the canvas uninitialised
+        if color is None:
+            self.pixels = np.empty(shape, dtype=np.uint8)
+            return
+
+        self.pixels = np.zeros(shape, dtype=np.uint8)
+        if color != (0, 0, 0) and color != 0:
+            fillRegion(self.pixels, color)
+
+    def rectangle(self, xy, fill):
+        if len(xy) == 2:
+            (x0, y0), (x1, y1) = xy
+        else:
+            x0, y0, x1, y1 = xy
+
+        if self.scale != 1:
+            x0, y0, x1, y1 = x0 * self.scale, y0 * self.scale, x1 * self.scale, y1 * self.scale
+
+        # truncate in scene coordinates first so a shifted canvas rounds exactly like a full size one
+        originX, originY = self.origin
+        canvasHeight, canvasWidth = self.pixels.shape[:2]
+        x0, y0 = max(0, int(x0) - originX), max(0, int(y0) - originY)
+        x1, y1 = min(canvasWidth - 1, int(x1) - originX), min(canvasHeight - 1, int(y1) - originY)
+
+        if x0 <= x1 and y0 <= y1:
+            fillRegion(self.pixels[y0:y1 + 1, x0:x1 + 1], fill)
+
+    def toImage(self):
+        img = Image.new(self.mode, (self.pixels.shape[1], self.pixels.shape[0]), None)
+        img.frombytes(self.pixels)
+        return img
+
+
+def litWindowRows(rng, rows, cols):
+    # one draw per window, in the same row by row order the original drawing loops used
+    return np.array([rng.random() < litWindowRate for _ in range(rows * cols)], dtype=bool).reshape(rows, cols)
+
+
+def litWindowMask(rng, rows, cols):
+    # one draw from rng seeds a numpy generator so the whole grid is made in a single call
+    generator = np.random.default_rng(rng.getrandbits(64))
+    return generator.random((rows, cols)) < litWindowRate
+
+
+def windowSize(windowStyle, width):
     if windowStyle == "wide":
-        windowHeight = 4
-        windowWidth = width - 10
-        minWindowSpacing = 6  # vertical space between windows
-        
-        # calculate how many windows can fit
-        maxRows = (totalHeight - minWindowSpacing) // (windowHeight + minWindowSpacing)
-        maxRows = max(1, maxRows)
+        return width - 10, 4
+    if windowStyle == "normal":
+        return 6, 6
+    return 6, 12
+
+
+def windowGridSize(windowStyle, width, totalHeight):
+    # how many rows and columns of windows fit on a building face
+    windowWidth, windowHeight = windowSize(windowStyle, width)
+    minWindowSpacing = 6
+
+    maxRows = max(1, (totalHeight - minWindowSpacing) // (windowHeight + minWindowSpacing))
+    if windowStyle == "wide":
+        return maxRows, 1
+    return maxRows, max(1, (width - minWindowSpacing) // (windowWidth + minWindowSpacing))
+
+
+def layerBaseline(h, layerIndex):
+    # y the buildings of a layer stand on, each layer further back sits 20px higher
+    return h - (numLayers * 15) + (numLayers - 1 - layerIndex) * 20
+
+
+def roofLightPositions(x, width):
+    # lights are spread evenly and centred along the roof
+    maxLights = (width - roofLightSize) // (roofLightSize + roofLightSpacing)
+    totalLightsWidth = maxLights * roofLightSize + (maxLights - 1) * roofLightSpacing
+    startX = x + (width - totalLightsWidth) // 2
+    return [startX + i * (roofLightSize + roofLightSpacing) for i in range(maxLights)]
+
+
+def windowColumnSpans(windowStyle, x, width, cols):
+    # inclusive pixel columns of each window column, spaced the same way drawWindows spaces them
+    windowWidth, _ = windowSize(windowStyle, width)
+    if windowStyle == "wide":
+        wx = np.array([x + 4])
+    else:
+        horizSpacing = (width - cols * windowWidth) / (cols + 1)
+        wx = x + horizSpacing + np.arange(cols) * (windowWidth + horizSpacing)
+    return wx.astype(np.int64), (wx + windowWidth).astype(np.int64)
+
+
+def spanCoverTop(cover, start, end):
+    # spanCoverTops for a single span, without the array overhead
+    coverStart, tops = cover
+    start, end = max(0, start - coverStart), min(len(tops), end - coverStart + 1)
+    return int(tops[start:end].max()) if start < end else -1
+
+
+def spanCoverTops(cover, starts, ends):
+    # for each inclusive column span, the row from which every canvas column in it is covered by nearer
+    # buildings, so anything drawn in the span from that row down gets painted over. -1 for spans off the canvas
+    coverStart, tops = cover
+    starts = np.clip(np.asarray(starts, dtype=np.int64) - coverStart, 0, len(tops))
+    ends = np.clip(np.asarray(ends, dtype=np.int64) - coverStart + 1, 0, len(tops))
+    spanTops = np.maximum.reduceat(np.append(tops, -1), np.stack([starts, ends], axis=1).ravel())[::2]
+    return np.where(starts < ends, spanTops, -1)
+
+
+def windowGrid(windowStyle, x, yTop, width, totalHeight):
+    # same spacing maths as drawWindows, returned as inclusive pixel spans for every window column and row segment
+    maxRows, maxCols = windowGridSize(windowStyle, width, totalHeight)
+    colStarts, colEnds = windowColumnSpans(windowStyle, x, width, maxCols)
+    rowStarts, rowEnds = windowRowSpans(windowStyle, yTop, width, totalHeight)
+    segments = len(rowStarts) // maxRows
+    rowLabels = np.arange(maxRows).repeat(segments)
+
+    return maxRows, maxCols, (colStarts, colEnds, np.arange(maxCols)), (rowStarts, rowEnds, rowLabels)
+
+
+def windowRowSpans(windowStyle, yTop, width, totalHeight):
+    # inclusive pixel rows of every window row segment, spaced the same way drawWindows spaces them
+    _, windowHeight = windowSize(windowStyle, width)
+    maxRows, _ = windowGridSize(windowStyle, width, totalHeight)
+
+    vertSpacing = (totalHeight - maxRows * windowHeight) / (maxRows + 1)
+    wy = yTop + vertSpacing + np.arange(maxRows) * (windowHeight + vertSpacing)
+
+    # tall styles split each window into two segments around a divider
+    segments = 1 if windowStyle in ("normal", "wide") else 2
+    rowStarts = np.empty((maxRows, segments))
+    rowEnds = np.empty((maxRows, segments))
+    if windowStyle == "tall":
+        dividerY = wy + int(windowHeight * 0.25)
+        rowStarts[:, 0], rowEnds[:, 0] = wy, dividerY - 1
+        rowStarts[:, 1], rowEnds[:, 1] = dividerY + 3, wy + windowHeight
+    elif windowStyle == "tall-inverse":
+        dividerY = wy + int(windowHeight * 0.75)
+        rowStarts[:, 0], rowEnds[:, 0] = wy, dividerY - 3
+        rowStarts[:, 1], rowEnds[:, 1] = dividerY + 1, wy + windowHeight
+    else:
+        rowStarts[:, 0], rowEnds[:, 0] = wy, wy + windowHeight
+
+    return rowStarts.ravel().astype(np.int64), rowEnds.ravel().astype(np.int64)
+
+
+def spanLabels(pixelStart, pixelStop, spans):
+    # label every pixel in [pixelStart, pixelStop) with the span covering it, or -1 for the gaps between spans
+    starts, ends, labels = spans
+    coords = np.arange(pixelStart, pixelStop)
+    span = np.maximum(np.searchsorted(starts, coords, side="right") - 1, 0)
+    inside = (coords >= starts[span]) & (coords <= ends[span])
+    return np.where(inside, labels[span], -1)
+
+
+def scaleSpans(spans, scale):
+    starts, ends, labels = spans
+    return (starts * scale).astype(np.int64), (ends * scale).astype(np.int64), labels
+
+
+def stampWindows(canvas, windowStyle, lit, x, yTop, width, totalHeight, windowColorOn, windowColorOff, visibleBottom=occlusionNone):
+    rows, cols, colSpans, rowSpans = windowGrid(windowStyle, x, yTop, width, totalHeight)
+    if canvas.scale != 1:
+        colSpans, rowSpans = scaleSpans(colSpans, canvas.scale), scaleSpans(rowSpans, canvas.scale)
+
+    # spans are worked out in scene coordinates and only shifted onto the canvas once clipped
+    originX, originY = canvas.origin
+    canvasHeight, canvasWidth = canvas.pixels.shape[:2]
+    x0, x1 = max(originX, colSpans[0][0]), min(originX + canvasWidth, colSpans[1][-1] + 1)
+    # rows from visibleBottom down are hidden behind nearer buildings
+    y0, y1 = max(originY, rowSpans[0][0]), min(originY + canvasHeight, rowSpans[1][-1] + 1, visibleBottom)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    rowIndex = spanLabels(y0, y1, rowSpans)
+    colIndex = spanLabels(x0, x1, colSpans)
+    x0, x1, y0, y1 = x0 - originX, x1 - originX, y0 - originY, y1 - originY
+    windowRows = np.flatnonzero(rowIndex >= 0)
+    windowCols = np.flatnonzero(colIndex >= 0)
+    if not windowRows.size or not windowCols.size:
+        return
+
+    # windows sit on the building's freshly drawn body, so every pixel row of a window row is identical:
+    # build one line per window row over a copy of the body and copy those lines down
+    region = canvas.pixels[y0:y1, x0:x1]
+    palette = np.array([windowColorOff, windowColorOn], dtype=np.uint8)
+    lines = np.repeat(region[windowRows[:1]], rows, axis=0)
+    lines[:, windowCols] = palette[lit[:, colIndex[windowCols]].view(np.uint8)]
+    region[windowRows] = lines[rowIndex[windowRows]]
+
+
+def fillWindowBlock(canvas, windowStyle, lit, x, yTop, width, totalHeight, buildingColor, windowColorOn, windowColorOff):
+    # windows too small to draw one by one: the block they sit in is filled with its average colour, the body
+    # and window colours mixed by how much of the block is window and how many of the windows are lit
+    windowWidth, windowHeight = windowSize(windowStyle, width)
+    rows, cols = lit.shape
+    vertSpacing = (totalHeight - rows * windowHeight) / (rows + 1)
+    horizSpacing = 4 if windowStyle == "wide" else (width - cols * windowWidth) / (cols + 1)
+
+    blockWidth = cols * windowWidth + (cols - 1) * horizSpacing
+    blockHeight = rows * windowHeight + (rows - 1) * vertSpacing
+    paneHeight = windowHeight - 3 if windowStyle in ("tall", "tall-inverse") else windowHeight  # minus the divider
+    coverage = min(1.0, rows * cols * windowWidth * paneHeight / max(1, blockWidth * blockHeight))
+    litShare = np.count_nonzero(lit) / lit.size
+
+    color = tuple(
+        int(body * (1 - coverage) + (on * litShare + off * (1 - litShare)) * coverage)
+        for body, on, off in zip(buildingColor, windowColorOn, windowColorOff))
+    wx, wy = x + horizSpacing, yTop + vertSpacing
+    canvas.rectangle((wx, wy, wx + blockWidth, wy + blockHeight), fill=color)
+
+
+class BuildingLayer:
+    # one layer of buildings stored column-wise, every attribute is a compact array indexed by building,
+    # and each building's window lit states are bit-packed into one shared buffer at windowOffset
+    def __init__(self):
+        self.x = array('i')
+        self.width = array('H')
+        self.height = array('H')
+        self.gap = array('B')
+        self.style = array('b')  # index into windowStyles, -1 until the windows are first drawn
+        self.roofLights = array('b')  # -1 until decided, then 0 or 1
+        self.windowOffset = array('q')  # byte offset into windowBits
+        self.windowRows = array('H')
+        self.windowCols = array('H')
+        self.windowBits = bytearray()
+        self.windowDeadBytes = 0  # bytes of windowBits no building's grid points at any more
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, x, width, height, gap):
+        self.x.append(x)
+        self.width.append(width)
+        self.height.append(height)
+        self.gap.append(gap)
+        self.style.append(-1)
+        self.roofLights.append(-1)
+        self.windowOffset.append(0)
+        self.windowRows.append(0)
+        self.windowCols.append(0)
+
+    def end(self):
+        # x where the next building would start
+        if not self.x:
+            return 0
+        return self.x[-1] + self.width[-1] + self.gap[-1]
+
+    def buildingAt(self, x):
+        # buildings are sorted by x and never overlap, so the one covering column x is found by bisection
+        index = bisect_right(self.x, x) - 1
+        if index >= 0 and x <= self.x[index] + self.width[index]:
+            return index
+        return None
+
+    def buildingsInRange(self, xStart, xEnd=None):
+        # indices of the buildings covering any column in [xStart, xEnd)
+        first = bisect_right(self.x, xStart) - 1
+        if first < 0 or xStart > self.x[first] + self.width[first]:
+            first += 1
+        last = len(self) if xEnd is None else bisect_left(self.x, xEnd)
+        return range(first, max(first, last))
+
+    def windowLitGrid(self, index):
+        rows, cols = self.windowRows[index], self.windowCols[index]
+        if not rows:
+            return None
+
+        count = rows * cols
+        packed = np.frombuffer(self.windowBits, dtype=np.uint8, count=(count + 7) // 8, offset=self.windowOffset[index])
+        return np.unpackbits(packed, count=count).view(bool).reshape(rows, cols)
+
+    def toggleWindowLit(self, index, row, col):
+        # flips one stored window in place, bits are packed row by row with the first window in the high bit
+        bit = row * self.windowCols[index] + col
+        self.windowBits[self.windowOffset[index] + bit // 8] ^= 0x80 >> (bit % 8)
+
+    def storedGridBytes(self, index):
+        return (self.windowRows[index] * self.windowCols[index] + 7) // 8
+
+    def storeWindowLitGrid(self, index, lit):
+        # a grid that fits where the old one was overwrites it, a bigger one is appended and the old bits are
+        # left behind until enough of the buffer is dead to be worth compacting
+        packed = np.packbits(lit).tobytes()
+        oldBytes = self.storedGridBytes(index)
+        if oldBytes and len(packed) <= oldBytes:
+            offset = self.windowOffset[index]
+            self.windowBits[offset:offset + len(packed)] = packed
+            self.windowDeadBytes += oldBytes - len(packed)
+        else:
+            self.windowDeadBytes += oldBytes
+            self.windowOffset[index] = len(self.windowBits)
+            self.windowBits += packed
+        self.windowRows[index], self.windowCols[index] = lit.shape
+
+        if self.windowDeadBytes > windowBitsDeadShare * len(self.windowBits):
+            self.compactWindowBits()
+
+    def clearWindowLitGrid(self, index):
+        # the building picks a new grid the next time it's drawn
+        self.windowDeadBytes += self.storedGridBytes(index)
+        self.windowRows[index] = self.windowCols[index] = 0
+
+    def compactWindowBits(self):
+        # copies every building's grid into a new buffer back to back, dropping the bits nothing points at
+        bits = bytearray()
+        for index in range(len(self)):
+            size = self.storedGridBytes(index)
+            if size:
+                offset = self.windowOffset[index]
+                self.windowOffset[index] = len(bits)
+                bits += self.windowBits[offset:offset + size]
+        self.windowBits = bits
+        self.windowDeadBytes = 0
+
+    def buildingBytes(self):
+        return sum(column.itemsize * len(column) for column in (
+            self.x, self.width, self.height, self.gap, self.style, self.roofLights,
+            self.windowOffset, self.windowRows, self.windowCols))
+
+    def windowBytes(self):
+        return len(self.windowBits)
+
+
+class RenderStats:
+    # wall time per render stage and counts of what was drawn, cheap enough to leave on all the time.
+    # stages can nest: windows and roofLights are part of layers
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+
+def timedStage(stage):
+    # adds every call's wall time to the renderer's current stats under stage
+    def decorate(method):
+        @wraps(method)
+        def timed(self, *args, **kwargs):
+            startTime = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stats.add(stage, time.perf_counter() - startTime)
+        return timed
+    return decorate
+
+
+class CityRenderer:
+    # owns one scene (colours, buildings, window states) and the rng it was generated from,
+    # so separate renderers can be used side by side without sharing anything
+    def __init__(self, seed=None, rng=None):
+        self.rng = rng if rng is not None else random.Random(seed)
+        self.stats = RenderStats()
+        self.lastStats = None  # timings and counts of the last finished render
+        self.renderStart = None
+        self.reset()
+
+    def reset(self):
+        # clears the stored scene so the next generateCityImage call starts a fresh one
+        self.skyHsl = None
+        self.skyColor = None
+        self.buildingColors = None
+        self.buildingsData = []
+        self.maxBuildingHeight = maxBuildingHeight
+        self.roofLightColor = None
+        self.isSkyDark = False  # track if sky is dark enough for roof lights
+        self.windowColorTable = {}  # (layer colour, layer index) -> lit and unlit window colours
+        self.paletteCache = (None, None)
+        self.indexRenders = {}  # last palette-indexed canvas for each roof light visibility, reused when only the size changes
+
+    def generateSkyColor(self):
+        hue = self.rng.uniform(0, 1)
+        saturation = self.rng.uniform(0.1, 0.3)
+        brightness = self.rng.uniform(0.2, 0.9)
+    
+        self.isSkyDark = brightness < skyBrightnessDarkThreshold
+
+        r, g, b = colorsys.hls_to_rgb(hue, brightness, saturation)
+    
+        return (hue, saturation, brightness), (int(r * 255), int(g * 255), int(b * 255))
+
+    def windowLitGrid(self, layer, index, rows, cols, bulk):
+        # stored lit states for a building, with any rows that don't exist yet (the building got taller on resize) topped up
+        lit = layer.windowLitGrid(index) if index is not None else None
+        storedRows = 0 if lit is None else len(lit)
+        if storedRows >= rows:
+            return lit[:rows]
+
+        if bulk:
+            newRows = litWindowMask(self.rng, rows - storedRows, cols)
+        else:
+            newRows = litWindowRows(self.rng, rows - storedRows, cols)
+        lit = newRows if lit is None else np.concatenate([lit, newRows])
+
+        if index is not None:
+            layer.storeWindowLitGrid(index, lit)
+        return lit
+
+    def buildingWindowStyle(self, layer, buildingId):
+        # if building already has window data, use it. otherwise pick a style for it
+        if layer is not None and layer.style[buildingId] >= 0:
+            return windowStyles[layer.style[buildingId]]
+
+        windowStyle = self.rng.choices( 
+            windowStyles, 
+            weights=windowStyleWeights, 
+            k=1
+        )[0]
+
+        if layer is not None:
+            layer.style[buildingId] = windowStyles.index(windowStyle)
+        return windowStyle
+
+    def buildingHasRoofLights(self, layer, buildingId):
+        # if building already has roof light data, use it, otherwise decide if building will have roof it
+        if layer is not None and layer.roofLights[buildingId] >= 0:
+            return layer.roofLights[buildingId] == 1
+
+        hasLights = self.rng.random() < roofLightChance
+
+        if layer is not None:
+            layer.roofLights[buildingId] = int(hasLights)
+        return hasLights
+
+    @timedStage("windows")
+    def drawWindows(self, draw, x, yTop, width, totalHeight, buildingColor, layerIndex, buildingId=None, windowPaints=None, cover=None):
+        # buildingId is the building's index in its layer, window data is only stored for buildings that have one
+        layer = self.buildingsData[layerIndex] if buildingId is not None else None
+
+        windowStyle = self.buildingWindowStyle(layer, buildingId)
+    
+        # windowPaints overrides the colours worked out from the building, e.g. with palette indices
+        if windowPaints is None:
+            colors = self.windowColorTable.get((tuple(buildingColor), layerIndex))
+            windowColorOn, windowColorOff = colors or windowColors(buildingColor, layerIndex)
+        else:
+            windowColorOn, windowColorOff = windowPaints
+
+        maxRows, maxCols = windowGridSize(windowStyle, width, totalHeight)
+        vectorized = isinstance(draw, ArrayCanvas)
+        litGrid = self.windowLitGrid(layer, buildingId, maxRows, maxCols, bulk=vectorized)
+        self.stats.count('windows', maxRows * maxCols)
+
+        if vectorized and draw.scale < lodWindowScale and windowPaints is None:
+            fillWindowBlock(draw, windowStyle, litGrid, x, yTop, width, totalHeight, buildingColor, windowColorOn, windowColorOff)
+            return buildingId
+
+        # windows sit inside the building, so none show below the row its whole width is covered from
+        visibleBottom = occlusionNone if cover is None else spanCoverTop(cover, x, x + width)
+        if visibleBottom <= yTop:
+            self.stats.count('culledWindows', maxRows * maxCols)
+            return buildingId
+
+        if vectorized:
+            stampWindows(draw, windowStyle, litGrid, x, yTop, width, totalHeight, windowColorOn, windowColorOff, visibleBottom)
+            return buildingId
+
+        # one rectangle at a time each window column can be cut off where it goes behind a nearer building,
+        # widened a pixel either side so rounding can't uncover anything
+        colTops = [occlusionNone] * maxCols
+        if cover is not None:
+            colStarts, colEnds = windowColumnSpans(windowStyle, x, width, maxCols)
+            colTops = [spanCoverTop(cover, start - 1, end + 1) for start, end in zip(colStarts.tolist(), colEnds.tolist())]
+            visibleBottom = max(colTops)
+    
+        # tall styles draw each window as two rectangles
+        segments = 1 if windowStyle in ("normal", "wide") else 2
+        drawn = 0
+
+        if windowStyle == "wide":
+            windowHeight = 4
+            windowWidth = width - 10
         
-        # calculate spacing to distribute windows evenly vertically
-        totalWindowHeightSpace = maxRows * windowHeight
-        vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
+            # calculate spacing to distribute windows evenly vertically
+            totalWindowHeightSpace = maxRows * windowHeight
+            vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
         
-        # generate positioning if needed
-        if not windowsData[buildingId]['positions']:
             for row in range(maxRows):
-                lit = random.random() < litWindowRate
-                windowsData[buildingId]['positions'].append(lit)
-        
-        # draw windows using stored positions
-        for row in range(maxRows):
-            wx = x + 4  # 4px clearance from left edge
-            wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
-            rect = (wx, wy, wx + windowWidth, wy + windowHeight)
-            
-            if row < len(windowsData[buildingId]['positions']):
-                lit = windowsData[buildingId]['positions'][row]
-            else:
-                lit = random.random() < litWindowRate
-                windowsData[buildingId]['positions'].append(lit)
+                wx = x + 4  # 4px clearance from left edge
+                wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
+                if int(wy) >= visibleBottom:
+                    break  # this row and every one below it are behind nearer buildings
+                rect = (wx, wy, wx + windowWidth, wy + windowHeight)
+                lit = litGrid[row][0]
                 
-            draw.rectangle(rect, fill=windowColorOn if lit else windowColorOff)
+                draw.rectangle(rect, fill=windowColorOn if lit else windowColorOff)
+                drawn += 1
             
-    elif windowStyle == "tall":
-        windowWidth = 6
-        windowHeight = 12
-        minWindowSpacing = 6
+        elif windowStyle == "tall":
+            windowWidth = 6
+            windowHeight = 12
         
-        maxCols = (width - minWindowSpacing) // (windowWidth + minWindowSpacing)
-        maxRows = (totalHeight - minWindowSpacing) // (windowHeight + minWindowSpacing)
+            totalWindowWidthSpace = maxCols * windowWidth
+            totalWindowHeightSpace = maxRows * windowHeight
         
-        maxCols = max(1, maxCols)
-        maxRows = max(1, maxRows)
+            horizSpacing = (width - totalWindowWidthSpace) / (maxCols + 1)
+            vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
         
-        totalWindowWidthSpace = maxCols * windowWidth
-        totalWindowHeightSpace = maxRows * windowHeight
-        
-        horizSpacing = (width - totalWindowWidthSpace) / (maxCols + 1)
-        vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
-        
-        if not windowsData[buildingId]['positions']:
             for row in range(maxRows):
-                row_lights = []
+                if int(yTop + vertSpacing + row * (windowHeight + vertSpacing)) >= visibleBottom:
+                    break
                 for col in range(maxCols):
-                    lit = random.random() < litWindowRate
-                    row_lights.append(lit)
-                windowsData[buildingId]['positions'].append(row_lights)
-        
-        for row in range(maxRows):
-            for col in range(maxCols):
-                wx = x + horizSpacing + col * (windowWidth + horizSpacing)
-                wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
-                
-                # changes how far up the divider is in the window
-                dividerY = wy + int(windowHeight * 0.25)
+                    wx = x + horizSpacing + col * (windowWidth + horizSpacing)
+                    wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
+                    if int(wy) >= colTops[col]:
+                        continue
                 
-                # if row and column exist in data, get lit status
-                if row < len(windowsData[buildingId]['positions']) and col < len(windowsData[buildingId]['positions'][row]):
-                    lit = windowsData[buildingId]['positions'][row][col]
-                else:
-                    lit = random.random() < litWindowRate
-                    
-                    while row >= len(windowsData[buildingId]['positions']):
-                        windowsData[buildingId]['positions'].append([])
-                        
-                    while col >= len(windowsData[buildingId]['positions'][row]):
-                        windowsData[buildingId]['positions'][row].append(False)
-                        
-                    windowsData[buildingId]['positions'][row][col] = lit
+                    # changes how far up the divider is in the window
+                    dividerY = wy + int(windowHeight * 0.25)
                 
-                windowColor = windowColorOn if lit else windowColorOff
+                    windowColor = windowColorOn if litGrid[row][col] else windowColorOff
                 
-                upperRect = (wx, wy, wx + windowWidth, dividerY - 1)
-                draw.rectangle(upperRect, fill=windowColor)
+                    upperRect = (wx, wy, wx + windowWidth, dividerY - 1)
+                    draw.rectangle(upperRect, fill=windowColor)
                 
-                # change value here to increase divider by decreasing the window's larger half's height
-                lowerRect = (wx, dividerY + 3, wx + windowWidth, wy + windowHeight)
-                draw.rectangle(lowerRect, fill=windowColor)
+                    # change value here to increase divider by decreasing the window's larger half's height
+                    lowerRect = (wx, dividerY + 3, wx + windowWidth, wy + windowHeight)
+                    draw.rectangle(lowerRect, fill=windowColor)
+                    drawn += 1
     
-    elif windowStyle == "tall-inverse":
-        windowWidth = 6
-        windowHeight = 12
-        minWindowSpacing = 6
+        elif windowStyle == "tall-inverse":
+            windowWidth = 6
+            windowHeight = 12
         
-        maxCols = (width - minWindowSpacing) // (windowWidth + minWindowSpacing)
-        maxRows = (totalHeight - minWindowSpacing) // (windowHeight + minWindowSpacing)
+            totalWindowWidthSpace = maxCols * windowWidth
+            totalWindowHeightSpace = maxRows * windowHeight
         
-        maxCols = max(1, maxCols)
-        maxRows = max(1, maxRows)
+            horizSpacing = (width - totalWindowWidthSpace) / (maxCols + 1)
+            vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
         
-        totalWindowWidthSpace = maxCols * windowWidth
-        totalWindowHeightSpace = maxRows * windowHeight
-        
-        horizSpacing = (width - totalWindowWidthSpace) / (maxCols + 1)
-        vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
-        
-        if not windowsData[buildingId]['positions']:
             for row in range(maxRows):
-                row_lights = []
+                if int(yTop + vertSpacing + row * (windowHeight + vertSpacing)) >= visibleBottom:
+                    break
                 for col in range(maxCols):
-                    lit = random.random() < litWindowRate
-                    row_lights.append(lit)
-                windowsData[buildingId]['positions'].append(row_lights)
-        
-        for row in range(maxRows):
-            for col in range(maxCols):
-                wx = x + horizSpacing + col * (windowWidth + horizSpacing)
-                wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
+                    wx = x + horizSpacing + col * (windowWidth + horizSpacing)
+                    wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
+                    if int(wy) >= colTops[col]:
+                        continue
                 
-                # changes how far up the divider is in the window
-                dividerY = wy + int(windowHeight * 0.75)
+                    # changes how far up the divider is in the window
+                    dividerY = wy + int(windowHeight * 0.75)
                 
-                if row < len(windowsData[buildingId]['positions']) and col < len(windowsData[buildingId]['positions'][row]):
-                    lit = windowsData[buildingId]['positions'][row][col]
-                else:
-                    lit = random.random() < litWindowRate
-                    
-                    while row >= len(windowsData[buildingId]['positions']):
-                        windowsData[buildingId]['positions'].append([])
-                        
-                    while col >= len(windowsData[buildingId]['positions'][row]):
-                        windowsData[buildingId]['positions'][row].append(False)
-                        
-                    windowsData[buildingId]['positions'][row][col] = lit
-                
-                windowColor = windowColorOn if lit else windowColorOff
+                    windowColor = windowColorOn if litGrid[row][col] else windowColorOff
                 
-                # change value here to increase divider by decreasing the window's larger half's height
-                upperRect = (wx, wy, wx + windowWidth, dividerY - 3)
-                draw.rectangle(upperRect, fill=windowColor)
+                    # change value here to increase divider by decreasing the window's larger half's height
+                    upperRect = (wx, wy, wx + windowWidth, dividerY - 3)
+                    draw.rectangle(upperRect, fill=windowColor)
                 
 
-                lowerRect = (wx, dividerY + 1, wx + windowWidth, wy + windowHeight)
-                draw.rectangle(lowerRect, fill=windowColor)
+                    lowerRect = (wx, dividerY + 1, wx + windowWidth, wy + windowHeight)
+                    draw.rectangle(lowerRect, fill=windowColor)
+                    drawn += 1
 
-    else:  # normal windows
-        windowWidth = 6
-        windowHeight = 6
-        minWindowSpacing = 6
-        
-        maxCols = (width - minWindowSpacing) // (windowWidth + minWindowSpacing)
-        maxRows = (totalHeight - minWindowSpacing) // (windowHeight + minWindowSpacing)
-        
-        maxCols = max(1, maxCols)
-        maxRows = max(1, maxRows)
+        else:  # normal windows
+            windowWidth = 6
+            windowHeight = 6
         
-        totalWindowWidthSpace = maxCols * windowWidth
-        totalWindowHeightSpace = maxRows * windowHeight
+            totalWindowWidthSpace = maxCols * windowWidth
+            totalWindowHeightSpace = maxRows * windowHeight
         
-        horizSpacing = (width - totalWindowWidthSpace) / (maxCols + 1)
-        vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
+            horizSpacing = (width - totalWindowWidthSpace) / (maxCols + 1)
+            vertSpacing = (totalHeight - totalWindowHeightSpace) / (maxRows + 1)
         
-        if not windowsData[buildingId]['positions']:
             for row in range(maxRows):
-                row_lights = []
+                if int(yTop + vertSpacing + row * (windowHeight + vertSpacing)) >= visibleBottom:
+                    break
                 for col in range(maxCols):
-                    lit = random.random() < litWindowRate
-                    row_lights.append(lit)
-                windowsData[buildingId]['positions'].append(row_lights)
-        
-        for row in range(maxRows):
-            for col in range(maxCols):
-                wx = x + horizSpacing + col * (windowWidth + horizSpacing)
-                wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
-                rect = (wx, wy, wx + windowWidth, wy + windowHeight)
+                    wx = x + horizSpacing + col * (windowWidth + horizSpacing)
+                    wy = yTop + vertSpacing + row * (windowHeight + vertSpacing)
+                    if int(wy) >= colTops[col]:
+                        continue
+                    rect = (wx, wy, wx + windowWidth, wy + windowHeight)
                 
-                if row < len(windowsData[buildingId]['positions']) and col < len(windowsData[buildingId]['positions'][row]):
-                    lit = windowsData[buildingId]['positions'][row][col]
-                else:
-                    lit = random.random() < litWindowRate
-
-                    while row >= len(windowsData[buildingId]['positions']):
-                        windowsData[buildingId]['positions'].append([])
-                        
-                    while col >= len(windowsData[buildingId]['positions'][row]):
-                        windowsData[buildingId]['positions'][row].append(False)
-                        
-                    windowsData[buildingId]['positions'][row][col] = lit
-                
-                draw.rectangle(rect, fill=windowColorOn if lit else windowColorOff)
-    
-    return buildingId
+                    draw.rectangle(rect, fill=windowColorOn if litGrid[row][col] else windowColorOff)
+                    drawn += 1
 
+        self.stats.count('rectangles', drawn * segments)
+        self.stats.count('culledWindows', maxRows * maxCols - drawn)
+        return buildingId
 
-def addRoofLights(draw, x, width, yTop, buildingId=None):
-    # if building already has roof light data, use it, otherwise decide if building will have roof it
-    global currentRoofLightColor, isSkyDark
+    @timedStage("roofLights")
+    def addRoofLights(self, draw, x, width, yTop, buildingId=None, layerIndex=None, lightPaint=None, cover=None):
+        if not self.isSkyDark:
+            return
 
-    if not isSkyDark:
-        return
-
-    if buildingId is None:
-        buildingId = f"r_{x}_{yTop}_{width}"
-
-    if buildingId in windowsData and 'roofLights' in windowsData[buildingId]:
-        roofLightInfo = windowsData[buildingId]['roofLights']
-        hasLights = roofLightInfo['hasLights']
-        lightPositions = roofLightInfo['positions']
-    else:
-        hasLights = random.random() < roofLightChance
-        lightPositions = []
-        
-        if buildingId not in windowsData:
-            windowsData[buildingId] = {}
-        
-        windowsData[buildingId]['roofLights'] = {
-            'hasLights': hasLights,
-            'positions': lightPositions
-        }
-    
-    if not hasLights:
-        return
-    
-    # calculate how many lights can fit on the roof
-    maxLights = (width - roofLightSize) // (roofLightSize + roofLightSpacing)
+        layer = self.buildingsData[layerIndex] if buildingId is not None and layerIndex is not None else None
     
-    if not lightPositions:
-        totalLightsWidth = maxLights * roofLightSize + (maxLights - 1) * roofLightSpacing
-        startX = x + (width - totalLightsWidth) // 2
-        
-        for i in range(maxLights):
-            lightX = startX + i * (roofLightSize + roofLightSpacing)
-            lightPositions.append(lightX)
-        
-        windowsData[buildingId]['roofLights']['positions'] = lightPositions
-    
-    for lightX in lightPositions:
-        light_rect = (lightX, yTop - roofLightHeight - roofLightSize, 
-                     lightX + roofLightSize, yTop - roofLightHeight)
-        draw.rectangle(light_rect, fill=currentRoofLightColor)
-
+        if not self.buildingHasRoofLights(layer, buildingId):
+            return
 
-def generateBuildingsData(canvasWidth, buildingMaxHeight):
-    #generates and saves building data for consistency on resize and refresh buttons
-    allLayersData = []
+        # lights scaled under a pixel wouldn't show in a thumbnail
+        if isinstance(draw, ArrayCanvas) and roofLightSize * draw.scale < 1:
+            return
     
-    # create buildings for each layer
-    for layerIndex in range(numLayers):
-        x = 0
-        buildings = []
-        
-        # create buildings across the canvas width
-        while x < canvasWidth:
-            buildingWidth = random.randint(*buildingWidthRange)
-            maxHeight = min(buildingMaxHeight, absoluteMaxBuildingHeight)
-            minHeight = max(50, 30 + layerIndex * 15)
-            minHeight = min(minHeight, maxHeight - 10)
-            
-            # vary height based on layer
-            if layerIndex == numLayers - 1:
-                buildingHeight = random.randint(minHeight, min(maxHeight, height - 20))
-            else:
-                buildingHeight = random.randint(minHeight, maxHeight)
-                
-            gap = random.randint(5, 15)  # random gap between buildings
-            
-            buildingId = f"b_{x}_{layerIndex}_{buildingWidth}_{buildingHeight}"
-            
-            buildings.append({
-                'x': x,
-                'width': buildingWidth,
-                'height': buildingHeight,
-                'gap': gap,
-                'id': buildingId
-            })
-            
-            x += buildingWidth + gap
-            
-            if x >= canvasWidth:
-                break
-                
-        allLayersData.append(buildings)
-    
-    return allLayersData
-
+        lightPositions = roofLightPositions(x, width)
+        self.stats.count('roofLights', len(lightPositions))
+
+        # a light whose top row is already behind nearer buildings is left out
+        lightTop = yTop - roofLightHeight - roofLightSize
+        if cover is not None and lightPositions:
+            lightTops = spanCoverTops(cover, lightPositions, np.add(lightPositions, roofLightSize))
+            lightPositions = [lightX for lightX, top in zip(lightPositions, lightTops.tolist()) if lightTop < top]
+        self.stats.count('rectangles', len(lightPositions))
+
+        for lightX in lightPositions:
+            light_rect = (lightX, lightTop, 
+                         lightX + roofLightSize, yTop - roofLightHeight)
+            draw.rectangle(light_rect, fill=self.roofLightColor if lightPaint is None else lightPaint)
+
+    def generateBuildingsData(self, canvasWidth, buildingMaxHeight):
+        #generates and saves building data for consistency on resize and refresh buttons
+        allLayersData = [BuildingLayer() for _ in range(numLayers)]
+        return self.extendBuildingsData(allLayersData, 0, canvasWidth, buildingMaxHeight)
+
+    def extendBuildingsData(self, buildingsData, oldWidth, newWidth, buildingMaxHeight):
+        #extends building data on resize, appending to each layer in place
+        for layerIndex, layer in enumerate(buildingsData):
+            # find where to start adding new buildings
+            x = layer.end()
 
-def extendBuildingsData(buildingsData, oldWidth, newWidth, buildingMaxHeight):
-    #extends building data on resize
-    extendedData = []
-    
-    for layer in buildingsData:
-        extendedLayer = layer.copy()
-        lastX = 0
-        
-        # find where to start adding new buildings
-        if layer:
-            lastBuilding = layer[-1]
-            lastX = lastBuilding['x'] + lastBuilding['width'] + lastBuilding['gap']
-        
-        x = lastX
-        # add buildings until filling the new width
-        while x < newWidth:
-            buildingWidth = random.randint(*buildingWidthRange)
-            layerIndex = buildingsData.index(layer)
-            
             maxHeight = min(buildingMaxHeight, absoluteMaxBuildingHeight)
             minHeight = max(50, 30 + layerIndex * 15)
             minHeight = min(minHeight, maxHeight - 10)
+
+            # add buildings until filling the new width
+            while x < newWidth:
+                buildingWidth = self.rng.randint(*buildingWidthRange)
             
-            if layerIndex == numLayers - 1:
-                buildingHeight = random.randint(minHeight, min(maxHeight, height - 20))
-            else:
-                buildingHeight = random.randint(minHeight, maxHeight)
+                # vary height based on layer
+                if layerIndex == numLayers - 1:
+                    buildingHeight = self.rng.randint(minHeight, min(maxHeight, height - 20))
+                else:
+                    buildingHeight = self.rng.randint(minHeight, maxHeight)
                 
-            gap = random.randint(5, 15)
-            
-            buildingId = f"b_{x}_{layerIndex}_{buildingWidth}_{buildingHeight}"
-            
-            extendedLayer.append({
-                'x': x,
-                'width': buildingWidth,
-                'height': buildingHeight,
-                'gap': gap,
-                'id': buildingId
-            })
-            
-            x += buildingWidth + gap
+                gap = self.rng.randint(5, 15)  # random gap between buildings
+
+                layer.append(x, buildingWidth, buildingHeight, gap)
             
-        extendedData.append(extendedLayer)
+                x += buildingWidth + gap
     
-    return extendedData
-
-
-def drawBuildings(draw, yBase, color, layerIndex, buildings, canvasHeight):
-    for building in buildings:
-        buildingWidth = building['width']
-        buildingHeight = building['height']
-        x = building['x']
-        buildingId = building.get('id')
+        return buildingsData
+
+    def drawBuildings(self, draw, yBase, color, layerIndex, buildings, canvasHeight, xStart=0, xEnd=None, windowPaints=None, lightPaint=None, cover=None):
+        # only buildings overlapping [xStart, xEnd) are drawn. cover is (first column, row per column) of what
+        # nearer layers will paint over, a building body stops where the whole of it is hidden
+        buildingIds = buildings.buildingsInRange(xStart, xEnd)
+        self.stats.count('buildings', len(buildingIds))
+        if cover is not None and len(buildingIds):
+            xs = np.frombuffer(buildings.x, dtype=np.int32)[buildingIds.start:buildingIds.stop]
+            widths = np.frombuffer(buildings.width, dtype=np.uint16)[buildingIds.start:buildingIds.stop]
+            bodyBottoms = (np.minimum(spanCoverTops(cover, xs, xs + widths.astype(np.int64)) - 1, canvasHeight)).tolist()
+        else:
+            bodyBottoms = [canvasHeight] * len(buildingIds)
+
+        for buildingId, bodyBottom in zip(buildingIds, bodyBottoms):
+            buildingWidth = buildings.width[buildingId]
+            buildingHeight = buildings.height[buildingId]
+            x = buildings.x[buildingId]
         
-        yTop = yBase - buildingHeight
-        xEnd = x + buildingWidth
+            yTop = yBase - buildingHeight
+            xEnd = x + buildingWidth
 
-        if xEnd < x:
-            xEnd = x
+            if xEnd < x:
+                xEnd = x
 
-        draw.rectangle([x, yTop, xEnd, canvasHeight], fill=color)
+            # a hidden building still goes through its windows and roof lights so their random picks are made
+            if bodyBottom >= yTop:
+                draw.rectangle([x, yTop, xEnd, bodyBottom], fill=color)
+                self.stats.count('rectangles')
         
-        # draw windows and store buildingId for future reference
-        windowBuildingId = drawWindows(draw, x, yTop, buildingWidth, canvasHeight - yTop, color, layerIndex, buildingId)
-        
-        # update the building's ID if it was generated in drawWindows
-        if not buildingId:
-            building['id'] = windowBuildingId
-        
-        addRoofLights(draw, x, buildingWidth, yTop, buildingId)
-
-
-def generateCityImage(w, h, refreshColors=False, refreshBuildings=False):
-    global originalSkyHsl, originalSkyColor, originalBuildingColors, originalBuildingsData, originalMaxBuildingHeight, windowsData, currentRoofLightColor, isSkyDark
+            self.drawWindows(draw, x, yTop, buildingWidth, canvasHeight - yTop, color, layerIndex, buildingId, windowPaints, cover)
+            self.addRoofLights(draw, x, buildingWidth, yTop, buildingId, layerIndex, lightPaint, cover)
+
+    def memoryFootprint(self):
+        # bytes held by the scene's building columns and packed window states
+        buildings = sum(layer.buildingBytes() for layer in self.buildingsData)
+        windows = sum(layer.windowBytes() for layer in self.buildingsData)
+        return {'buildings': buildings, 'windows': windows, 'total': buildings + windows}
+
+    def newColors(self):
+        self.skyHsl, self.skyColor = self.generateSkyColor()
+        self.buildingColors = generateBuildingColors(*self.skyHsl)
+        self.updateColorTable()
+        self.roofLightColor = self.rng.choice(roofLightColors)
+        self.isSkyDark = self.skyHsl[2] < skyBrightnessDarkThreshold
+
+    def updateColorTable(self):
+        # window colours only depend on the layer colour and index, so they're worked out once per set of colours
+        self.windowColorTable = {
+            (color, i): windowColors(color, i) for i, color in enumerate(self.buildingColors)
+        }
 
-    # initialize colours and buildings if first run
-    if originalSkyHsl is None:
-        currentMaxBuildingHeight = min(h - minTopClearance - 160, absoluteMaxBuildingHeight)
-        originalMaxBuildingHeight = currentMaxBuildingHeight
+    def generateCityImage(self, w, h, refreshColors=False, refreshBuildings=False):
+        self.beginRender()
+        self.updateScene(w, h, refreshColors, refreshBuildings)
+
+        # every gradient band needs its own palette entry, a canvas too tall to fit them is drawn in rgb directly
+        if len(skyGradient(self.skyColor, h)) > maxSkyBands:
+            img = self.renderRgbImage(w, h)
+        else:
+            img = self.renderIndexImage(w, h)
+            startTime = time.perf_counter()
+            img.putpalette(self.scenePalette(h))
+            img = img.convert("RGB")
+            self.stats.add('convert', time.perf_counter() - startTime)
+
+        self.finishRender(w, h)
+        return img
+
+    def beginRender(self):
+        # starts a fresh set of stats, everything drawn until finishRender is counted towards it
+        self.stats = RenderStats()
+        self.renderStart = time.perf_counter()
+
+    def finishRender(self, w, h):
+        self.lastStats = {
+            'size': [w, h],
+            'totalSeconds': time.perf_counter() - self.renderStart,
+            'seconds': dict(self.stats.seconds),
+            'counts': dict(self.stats.counts),
+        }
+        if renderLog.isEnabledFor(logging.INFO):
+            renderLog.info(json.dumps(self.lastStats))
+
+    @timedStage("layout")
+    def updateScene(self, w, h, refreshColors=False, refreshBuildings=False):
+        # initialize colours and buildings if first run
+        if self.skyHsl is None:
+            currentMaxBuildingHeight = min(h - minTopClearance - 160, absoluteMaxBuildingHeight)
+            self.maxBuildingHeight = currentMaxBuildingHeight
+
+            self.skyHsl, self.skyColor = self.generateSkyColor()
+            self.buildingColors = generateBuildingColors(*self.skyHsl)
+            self.updateColorTable()
+            self.buildingsData = self.generateBuildingsData(w, self.maxBuildingHeight)
+            # sets roof light colour for the image
+            self.roofLightColor = self.rng.choice(roofLightColors)
+            self.indexRenders = {}
+
+        else:
+            # index renders don't depend on colours, so new colours keep them and only swap the palette
+            if refreshColors:
+                self.newColors()
+                print(self.skyHsl[2])
+
+            if refreshBuildings:
+                currentMaxBuildingHeight = min(h - minTopClearance - 120, absoluteMaxBuildingHeight)
+                self.maxBuildingHeight = currentMaxBuildingHeight
+                # window data lives with the buildings, so new buildings start with fresh windows
+                self.buildingsData = self.generateBuildingsData(w, self.maxBuildingHeight)
+                self.roofLightColor = self.rng.choice(roofLightColors)
+                self.indexRenders = {}
+
+            elif w > width and not refreshBuildings:
+                self.buildingsData = self.extendBuildingsData(self.buildingsData, width, w, self.maxBuildingHeight)
+
+    def settleBuildings(self, h):
+        # decides every building's window style, lit windows and roof lights in the order a full
+        # vectorized render would, so a scene drawn piece by piece doesn't depend on how it was split up
+        yBase = h - (numLayers * 15)
+
+        for i in range(numLayers - 1, -1, -1):
+            layer = self.buildingsData[i]
+            for buildingId in range(len(layer)):
+                yTop = yBase - layer.height[buildingId]
+                windowStyle = self.buildingWindowStyle(layer, buildingId)
+                maxRows, maxCols = windowGridSize(windowStyle, layer.width[buildingId], h - yTop)
+                self.windowLitGrid(layer, buildingId, maxRows, maxCols, bulk=True)
+
+                if self.isSkyDark:
+                    self.buildingHasRoofLights(layer, buildingId)
+            yBase += 20
+
+    def renderIndexTile(self, xStart, xEnd, h):
+        # palette indices for scene columns [xStart, xEnd), buildings crossing either edge are clipped to it
+        return self.renderIndexRegion(xStart, 0, xEnd, h, h)
+
+    def renderIndexRegion(self, x0, y0, x1, y1, h):
+        # palette indices for the scene rect [x0, x1) x [y0, y1): the sky behind it, then every building crossing it back to front
+        region = ArrayCanvas(x1 - x0, y1 - y0, None, "P", origin=(x0, y0))
+        self.drawSky(region, x1, h, x0, indexed=True)
+        self.drawLayers(region, h, x0, x1, indexed=True)
+        return region
+
+    def renderThumbnail(self, w, h, scale):
+        # the w x h scene drawn straight at scale (at most 1) rather than drawn in full and shrunk. from lodWindowScale
+        # down each building's windows become one averaged fill, and roof lights under a pixel are left out
+        self.beginRender()
+        self.updateScene(w, h)
+        canvas = ArrayCanvas(max(1, round(w * scale)), max(1, round(h * scale)), None, "RGB", scale=scale)
+        self.drawSky(canvas, w, h)
+        self.drawLayers(canvas, h)
+        self.finishRender(canvas.pixels.shape[1], canvas.pixels.shape[0])
+        return canvas.toImage()
+
+    def thumbnailPyramid(self, w, h, levels=4, scale=0.25):
+        # thumbnails of the w x h scene, largest first: the first is drawn at scale and each one after is the last
+        # one halved, which costs far less than drawing the scene again
+        thumbnails = [self.renderThumbnail(w, h, scale)]
+        for _ in range(levels - 1):
+            thumbnails.append(thumbnails[-1].reduce(2))
+        return thumbnails
+
+    def buildingUnder(self, x, y, h):
+        # the frontmost building covering scene pixel (x, y) as (layerIndex, buildingId), None over open sky
+        for layerIndex, layer in enumerate(self.buildingsData):
+            buildingId = layer.buildingAt(x)
+            if buildingId is not None and y >= layerBaseline(h, layerIndex) - layer.height[buildingId]:
+                return layerIndex, buildingId
+        return None
+
+    def buildingBounds(self, layerIndex, buildingId, h):
+        # scene rect (x0, y0, x1, y1), ends exclusive, covering the building and the roof lights it might have
+        layer = self.buildingsData[layerIndex]
+        x, yTop = layer.x[buildingId], layerBaseline(h, layerIndex) - layer.height[buildingId]
+        return x, yTop - roofLightHeight - roofLightSize, x + layer.width[buildingId] + 1, h
+
+    def redrawRegion(self, w, h, x0, y0, x1, y1):
+        # redraws the rect [x0, x1) x [y0, y1) of the cached w x h palette render in place and returns its new
+        # pixels, or None if there's no such render and the scene needs drawing in full
+        key = (self.isSkyDark, vectorizedWindows)
+        lastRender = self.indexRenders.get(key)
+        if lastRender is None or lastRender['size'] != (w, h):
+            return None
+
+        # any other cached render still shows the scene as it was
+        self.indexRenders = {key: lastRender}
+        x0, y0, x1, y1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+        if x0 >= x1 or y0 >= y1:
+            return np.empty((0, 0), dtype=np.uint8)
+
+        self.beginRender()
+        pixels = self.renderIndexRegion(x0, y0, x1, y1, h).pixels
+        if lastRender['pixels'] is not None:
+            lastRender['pixels'][y0:y1, x0:x1] = pixels
+        lastRender['image'].paste(Image.frombuffer("P", (x1 - x0, y1 - y0), pixels, "raw", "P", 0, 1), (x0, y0))
+        self.finishRender(x1 - x0, y1 - y0)
+        return pixels
+
+    def editBuilding(self, w, h, layerIndex, buildingId, height=None, rerollWindows=False, toggleRoofLights=False):
+        # changes one building and redraws only what it covered before and after the change. returns
+        # (x, y, pixels) for the redrawn rect, or None if there was no cached w x h render to patch
+        before = self.buildingBounds(layerIndex, buildingId, h)
+        layer = self.buildingsData[layerIndex]
+
+        if height is not None:
+            layer.height[buildingId] = max(1, min(height, absoluteMaxBuildingHeight))
+        if rerollWindows:
+            # a new style and lit grid are picked the next time the building is drawn
+            layer.style[buildingId] = -1
+            layer.clearWindowLitGrid(buildingId)
+        if toggleRoofLights:
+            layer.roofLights[buildingId] = 0 if layer.roofLights[buildingId] == 1 else 1
+
+        after = self.buildingBounds(layerIndex, buildingId, h)
+        x0, y0 = max(0, min(before[0], after[0])), max(0, min(before[1], after[1]))
+        pixels = self.redrawRegion(w, h, x0, y0, max(before[2], after[2]), h)
+        if pixels is None:
+            return None
+        return x0, y0, pixels
+
+    def generateCityPixels(self, w, h, refreshColors=False, refreshBuildings=False):
+        # the scene as an (h, w) array of palette indices plus its palette, shared with the render cache rather
+        # than copied when the canvas is an array. a canvas too tall for the palette comes back as (h, w, 3) rgb
+        self.beginRender()
+        self.updateScene(w, h, refreshColors, refreshBuildings)
+
+        if len(skyGradient(self.skyColor, h)) > maxSkyBands:
+            img, palette = self.renderRgbImage(w, h), None
+        else:
+            img, palette = self.renderIndexImage(w, h), self.scenePalette(h)
+
+        startTime = time.perf_counter()
+        pixels = None if palette is None else self.indexRenders[(self.isSkyDark, vectorizedWindows)]['pixels']
+        if pixels is None:
+            pixels = np.asarray(img)
+        self.stats.add('convert', time.perf_counter() - startTime)
+
+        self.finishRender(w, h)
+        return pixels, palette
+
+    def generateIndexImage(self, w, h):
+        # the current scene as a palette image, cheap to save or recolour without drawing anything again
+        self.beginRender()
+        self.updateScene(w, h)
+        img = self.renderIndexImage(w, h).copy()
+        img.putpalette(self.scenePalette(h))
+        self.finishRender(w, h)
+        return img
+
+    def colorVariants(self, w, h, count):
+        # same layout with new colours each time, only the first variant of each sky darkness draws anything
+        self.updateScene(w, h)
+        for _ in range(count):
+            self.newColors()
+            yield self.generateIndexImage(w, h)
+
+    def scenePalette(self, h):
+        # the last palette is kept until the colours or height change
+        key = (self.skyColor, tuple(self.buildingColors), self.roofLightColor, h)
+        if self.paletteCache[0] == key:
+            return self.paletteCache[1]
+
+        palette = [(0, 0, 0)] * 256
+        palette[roofLightIndex] = self.roofLightColor
+
+        for i, color in enumerate(self.buildingColors):
+            bodyIndex = layerPaletteIndex(i)
+            palette[bodyIndex] = color
+            palette[bodyIndex + 1], palette[bodyIndex + 2] = self.windowColorTable[(color, i)]
+
+        for band, (color, _, _) in enumerate(skyGradient(self.skyColor, h)):
+            palette[skyPaletteIndex + band] = color
+
+        palette = [channel for color in palette for channel in color]
+        self.paletteCache = (key, palette)
+        return palette
+
+    def newCanvas(self, w, h, mode):
+        # every pixel is painted by the sky or the last render, so the canvas is left uninitialised
+        if vectorizedWindows:
+            canvas = ArrayCanvas(w, h, None, mode)
+            return canvas, canvas
+        img = Image.new(mode, (w, h), None)
+        return img, ImageDraw.Draw(img)
+
+    def renderRgbImage(self, w, h):
+        img, draw = self.newCanvas(w, h, "RGB")
+        self.drawSky(draw, w, h)
+        self.drawLayers(draw, h)
+        return draw.toImage() if vectorizedWindows else img
+
+    def renderIndexImage(self, w, h):
+        # roof lights only show under a dark sky, so there is one cached render with them and one without
+        key = (self.isSkyDark, vectorizedWindows)
+        lastRender = self.indexRenders.get(key)
+        if lastRender is not None and lastRender['size'] == (w, h):
+            return lastRender['image']
+
+        img, draw = self.newCanvas(w, h, "P")
+
+        # a plain resize of the last render only rasterizes what it didn't already cover
+        if lastRender is None:
+            self.drawSky(draw, w, h, indexed=True)
+            self.drawLayers(draw, h, indexed=True)
+        else:
+            lastWidth, lastHeight = lastRender['size']
+            keepWidth = min(w, self.firstUndrawnX(lastWidth))
+
+            if h != lastHeight:
+                self.drawSky(draw, w, h, indexed=True)
+            elif w > keepWidth:
+                self.drawSky(draw, w, h, keepWidth, indexed=True)
+
+            if w > keepWidth:
+                self.drawLayers(draw, h, keepWidth, w, indexed=True)
+
+            self.pasteLastRender(img, draw, lastRender, keepWidth, h)
+
+        if vectorizedWindows:
+            img = draw.toImage()
+        self.indexRenders[key] = {'size': (w, h), 'image': img, 'pixels': draw.pixels if vectorizedWindows else None}
+        return img
+
+    @timedStage("sky")
+    def drawSky(self, draw, w, h, xStart=0, indexed=False):
+        # an indexed array canvas gets the cached sky column stretched across it in one go
+        if indexed and isinstance(draw, ArrayCanvas):
+            originX, originY = draw.origin
+            strip = skyIndexStrip(h)[originY:originY + draw.pixels.shape[0]]
+            draw.pixels[:, max(0, xStart - originX):w + 1 - originX] = strip[:, None]
+            return
+
+        for band, (color, yStart, yEnd) in enumerate(skyGradient(self.skyColor, h)):
+            draw.rectangle([(xStart, yStart), (w, yEnd)], fill=skyPaletteIndex + band if indexed else color)
+
+    @timedStage("layers")
+    def drawLayers(self, draw, h, xStart=0, xEnd=None, indexed=False):
+        # back layer first so nearer buildings are painted over it, leaving out what they'll cover
+        yBase = h - (numLayers * 15)
+        covers = self.layerCovers(draw, h, xStart, xEnd)
+
+        for i in range(numLayers - 1, -1, -1):
+            if indexed:
+                bodyIndex = layerPaletteIndex(i)
+                self.drawBuildings(draw, yBase, bodyIndex, i, self.buildingsData[i], h, xStart, xEnd,
+                                   (bodyIndex + 1, bodyIndex + 2), roofLightIndex, covers[i])
+            else:
+                self.drawBuildings(draw, yBase, self.buildingColors[i], i, self.buildingsData[i], h, xStart, xEnd,
+                                   cover=covers[i])
+            yBase += 20
+
+    def layerCovers(self, draw, h, xStart=0, xEnd=None):
+        # for every layer, the top row of the nearer layers' building bodies in each canvas column. bodies run to
+        # the bottom edge, so everything a layer draws from there down is painted over. None where nothing is culled
+        if isinstance(draw, ArrayCanvas):
+            if draw.scale != 1:
+                return [None] * numLayers
+            coverStart, coverWidth = draw.origin[0], draw.pixels.shape[1]
+        else:
+            coverStart, coverWidth = 0, draw.im.size[0]
+
+        tops = np.full(coverWidth, occlusionNone, dtype=np.int64)
+        covers = [None]
+        for i in range(numLayers - 1):
+            # only the buildings drawn in this pass can hide anything
+            layer = self.buildingsData[i]
+            buildingIds = layer.buildingsInRange(xStart, xEnd)
+            xs = np.frombuffer(layer.x, dtype=np.int32)[buildingIds.start:buildingIds.stop].astype(np.int64)
+            starts = np.maximum(xs, coverStart) - coverStart
+            ends = np.minimum(xs + np.frombuffer(layer.width, dtype=np.uint16)[buildingIds.start:buildingIds.stop],
+                              coverStart + coverWidth - 1) - coverStart
+            onCanvas = starts <= ends
+            starts, ends = starts[onCanvas], ends[onCanvas]
+            heights = np.frombuffer(layer.height, dtype=np.uint16)[buildingIds.start:buildingIds.stop][onCanvas]
+            yTops = layerBaseline(h, i) - heights.astype(np.int64)
+
+            # buildings in a layer never overlap, so each column gets at most one top
+            widths = ends - starts + 1
+            columns = np.repeat(starts, widths) + np.arange(widths.sum()) - np.repeat(np.cumsum(widths) - widths, widths)
+            tops[columns] = np.minimum(tops[columns], np.repeat(yTops, widths))
+            covers.append((coverStart, tops.copy()))
+        return covers
+
+    def skylineDepth(self):
+        # how far above the bottom edge the tallest building (and its roof lights) reaches
+        depth = 0
+        for layerIndex, layer in enumerate(self.buildingsData):
+            if len(layer):
+                layerOffset = (numLayers * 15) - (numLayers - 1 - layerIndex) * 20
+                depth = max(depth, layerOffset + max(layer.height))
+        return depth + roofLightHeight + roofLightSize + 1
+
+    def skylineMask(self, w, h, yStart):
+        # pixels from yStart down covered by a building or roof light, sky everywhere else
+        mask = np.zeros((h - yStart, w), dtype=bool)
+        rows = np.arange(yStart, h)[:, None]
+        yBase = h - (numLayers * 15)
+
+        for i in range(numLayers - 1, -1, -1):
+            layer = self.buildingsData[i]
+            xs = np.frombuffer(layer.x, dtype=np.int32)
+            visible = xs < w
+            xs = xs[visible]
+            widths = np.frombuffer(layer.width, dtype=np.uint16)[visible].astype(np.int64) + 1
+            tops = yBase - np.frombuffer(layer.height, dtype=np.uint16)[visible].astype(np.int64)
+
+            # building bodies run from their roof to the bottom edge, so one top per column covers them
+            columns = np.repeat(xs, widths) + np.arange(widths.sum()) - np.repeat(np.cumsum(widths) - widths, widths)
+            columnTops = np.repeat(tops, widths)
+            inside = columns < w
+            layerTop = np.full(w, h)
+            layerTop[columns[inside]] = columnTops[inside]
+            mask |= rows >= layerTop[None, :]
+
+            if self.isSkyDark:
+                for index in np.flatnonzero(np.frombuffer(layer.roofLights, dtype=np.int8)[visible] == 1):
+                    yTop = tops[index]
+                    for lightX in roofLightPositions(xs[index], widths[index] - 1):
+                        y0 = max(0, yTop - roofLightHeight - roofLightSize - yStart)
+                        mask[y0:max(0, yTop - roofLightHeight - yStart + 1), lightX:lightX + roofLightSize + 1] = True
+
+            yBase += 20
+
+        return mask
+
+    @timedStage("paste")
+    def pasteLastRender(self, img, draw, lastRender, keepWidth, h):
+        lastWidth, lastHeight = lastRender['size']
+
+        if h == lastHeight:
+            if vectorizedWindows:
+                draw.pixels[:, :keepWidth] = lastRender['pixels'][:, :keepWidth]
+            elif keepWidth < lastWidth:
+                img.paste(lastRender['image'].crop((0, 0, keepWidth, h)), (0, 0))
+            else:
+                # paste clips the last image to the new canvas, no need to crop it first
+                img.paste(lastRender['image'], (0, 0))
+            return
+
+        # the city is anchored to the bottom edge, so a height change just moves it up or down over a new sky
+        depth = min(self.skylineDepth(), lastHeight, h)
+        mask = self.skylineMask(keepWidth, lastHeight, lastHeight - depth)
+
+        if vectorizedWindows:
+            source = lastRender['pixels'][lastHeight - depth:, :keepWidth]
+            np.copyto(draw.pixels[h - depth:, :keepWidth], source, where=mask)
+        else:
+            source = lastRender['image'].crop((0, lastHeight - depth, keepWidth, lastHeight))
+            img.paste(source, (0, h - depth), Image.fromarray(mask.view(np.uint8) * 255, "L"))
+
+        # window rows are spaced in fractions of a pixel from the roof, so moving a building can round one of
+        # them differently. those buildings are drawn again, along with whatever sits in front of them
+        for x0, y0, x1, y1 in self.shiftedWindowBounds(keepWidth, lastHeight, h):
+            x1 = min(x1, keepWidth)
+            pixels = self.renderIndexRegion(x0, max(0, y0), x1, h, h).pixels
+            if vectorizedWindows:
+                draw.pixels[max(0, y0):h, x0:x1] = pixels
+            else:
+                img.paste(Image.frombuffer("P", (x1 - x0, pixels.shape[0]), pixels, "raw", "P", 0, 1), (x0, max(0, y0)))
+
+    def firstUndrawnX(self, lastWidth):
+        # the last render is only good up to the first building it didn't draw. a layer widened for a bigger
+        # canvas can start its next building in the gap before the old right edge
+        start = lastWidth
+        for layer in self.buildingsData:
+            for buildingId in range(bisect_left(layer.x, start)):
+                if layer.style[buildingId] < 0:
+                    start = layer.x[buildingId]
+                    break
+        return start
+
+    def shiftedWindowBounds(self, w, lastHeight, h):
+        # bounds of the buildings left of w whose window rows don't all move by exactly h - lastHeight
+        bounds = []
+        for layerIndex, layer in enumerate(self.buildingsData):
+            lastBase, base = layerBaseline(lastHeight, layerIndex), layerBaseline(h, layerIndex)
+            for buildingId in range(bisect_left(layer.x, w)):
+                buildingWidth, buildingHeight = layer.width[buildingId], layer.height[buildingId]
+                if layer.style[buildingId] >= 0:
+                    windowStyle = windowStyles[layer.style[buildingId]]
+                    totalHeight = lastHeight - (lastBase - buildingHeight)
+                    lastRows = windowRowSpans(windowStyle, lastBase - buildingHeight, buildingWidth, totalHeight)
+                    rows = windowRowSpans(windowStyle, base - buildingHeight, buildingWidth, totalHeight)
+                    if np.array_equal(lastRows[0] + (h - lastHeight), rows[0]) and np.array_equal(lastRows[1] + (h - lastHeight), rows[1]):
+                        continue
+                bounds.append(self.buildingBounds(layerIndex, buildingId, h))
+        return bounds
+
+# the module level functions drive a shared renderer that draws from the global random module
+defaultRenderer = CityRenderer(rng=random)
+
+
+def resetScene():
+    defaultRenderer.reset()
 
-        originalSkyHsl, originalSkyColor = generateSkyColor()
-        originalBuildingColors = generateBuildingColors(*originalSkyHsl)
-        originalBuildingsData = generateBuildingsData(w, originalMaxBuildingHeight)
-        # sets roof light colour for the image
-        currentRoofLightColor = random.choice(roofLightColors)
 
-    else:
-        if refreshColors:
-            originalSkyHsl, originalSkyColor = generateSkyColor()
-            originalBuildingColors = generateBuildingColors(*originalSkyHsl)
-            currentRoofLightColor = random.choice(roofLightColors)
-            
-            print(originalSkyHsl[2])
-            isSkyDark = originalSkyHsl[2] < skyBrightnessDarkThreshold  
+def generateSkyColor():
+    return defaultRenderer.generateSkyColor()
 
-        if refreshBuildings:
-            currentMaxBuildingHeight = min(h - minTopClearance - 120, absoluteMaxBuildingHeight)
-            originalMaxBuildingHeight = currentMaxBuildingHeight
-            originalBuildingsData = generateBuildingsData(w, originalMaxBuildingHeight)
-            # reset windows data when buildings are refreshed
-            windowsData = {}
-            currentRoofLightColor = random.choice(roofLightColors)
 
-        elif w > width and not refreshBuildings:
-            originalBuildingsData = extendBuildingsData(originalBuildingsData, width, w, originalMaxBuildingHeight)
+def drawWindows(draw, x, yTop, width, totalHeight, buildingColor, layerIndex, buildingId=None, windowPaints=None, cover=None):
+    return defaultRenderer.drawWindows(draw, x, yTop, width, totalHeight, buildingColor, layerIndex, buildingId, windowPaints, cover)
 
-    img = Image.new("RGB", (w, h), (0, 0, 0))
-    draw = ImageDraw.Draw(img)
 
-    # sky drawing section
+def addRoofLights(draw, x, width, yTop, buildingId=None, layerIndex=None, lightPaint=None, cover=None):
+    return defaultRenderer.addRoofLights(draw, x, width, yTop, buildingId, layerIndex, lightPaint, cover)
 
-    # original color
-    base_r, base_g, base_b = originalSkyColor
-    base_h, base_l, base_s = colorsys.rgb_to_hls(base_r / 255, base_g / 255, base_b / 255)
 
-    darker_l = max(0.0, base_l * 0.8)  # darkest gradient point
-    darker_r, darker_g, darker_b = colorsys.hls_to_rgb(base_h, darker_l, base_s)
-    darker_color = (int(darker_r * 255), int(darker_g * 255), int(darker_b * 255))
+def generateBuildingsData(canvasWidth, buildingMaxHeight):
+    return defaultRenderer.generateBuildingsData(canvasWidth, buildingMaxHeight)
 
-    gradient_start_y = int(h * 0.25)  # sky gradient start point
-    draw.rectangle([(0, gradient_start_y), (w, h)], fill=originalSkyColor)
 
-    gradient_height = gradient_start_y
-    num_bands = max(1, gradient_height // 20)  # increase for less gradient bands
-    band_height = gradient_height / num_bands
+def extendBuildingsData(buildingsData, oldWidth, newWidth, buildingMaxHeight):
+    return defaultRenderer.extendBuildingsData(buildingsData, oldWidth, newWidth, buildingMaxHeight)
 
-    for band in range(int(num_bands)):
-        ratio = band / (num_bands - 1) if num_bands > 1 else 0
 
-        #decrease the r,g,b value
-        r = int(base_r + (darker_color[0] - base_r) * ratio) 
-        g = int(base_g + (darker_color[1] - base_g) * ratio)
-        b = int(base_b + (darker_color[2] - base_b) * ratio)
+def drawBuildings(draw, yBase, color, layerIndex, buildings, canvasHeight, xStart=0, xEnd=None, windowPaints=None, lightPaint=None, cover=None):
+    return defaultRenderer.drawBuildings(draw, yBase, color, layerIndex, buildings, canvasHeight, xStart, xEnd, windowPaints, lightPaint, cover)
 
-        y_start = int(gradient_start_y - (band + 1) * band_height)
-        y_end = int(gradient_start_y - band * band_height)
 
-        draw.rectangle([(0, max(0, y_start)), (w, max(0, y_end))], fill=(r, g, b))
+def generateCityImage(w, h, refreshColors=False, refreshBuildings=False):
+    return defaultRenderer.generateCityImage(w, h, refreshColors, refreshBuildings)
+
+
+def generateCityPixels(w, h, refreshColors=False, refreshBuildings=False):
+    return defaultRenderer.generateCityPixels(w, h, refreshColors, refreshBuildings)
+
+
+def renderThumbnail(w, h, scale):
+    return defaultRenderer.renderThumbnail(w, h, scale)
+
+
+def thumbnailPyramid(w, h, levels=4, scale=0.25):
+    return defaultRenderer.thumbnailPyramid(w, h, levels, scale)
+
+
+def lastRenderStats():
+    return defaultRenderer.lastStats
+
+
+class WindowAnimator:
+    # brings a scene to life: every tick a few windows switch on or off and roof lights blink. only the
+    # pixels of what changed are repainted, so a tick costs the same however big the canvas is
+    def __init__(self, renderer, w, h):
+        renderer.updateScene(w, h)
+        checkIndexedHeight(renderer, h, "to animate")
+
+        renderer.settleBuildings(h)
+        self.renderer = renderer
+        self.size = (w, h)
+        self.palette = renderer.scenePalette(h)
+        self.generator = np.random.default_rng(renderer.rng.getrandbits(64))
+        self.ticks = 0
+
+        # the animation's palette indices, windows repainted each tick
+        self.frame = renderer.renderIndexTile(0, w, h).pixels
+
+        # the scene without roof lights is what shows through a light that's off, windows are kept up to date in both
+        self.unlitFrame = None
+        if renderer.isSkyDark:
+            renderer.isSkyDark = False
+            try:
+                self.unlitFrame = renderer.renderIndexTile(0, w, h).pixels
+            finally:
+                renderer.isSkyDark = True
+
+        # cached renders won't match the stored windows once they start flipping
+        renderer.indexRenders = {}
+        self.findWindows()
+        self.findRoofLights()
+
+    def findWindows(self):
+        # every window on the canvas as flat arrays: where its state is stored and its clipped pixel bounds
+        w, h = self.size
+        columns = {name: [] for name in ('layer', 'building', 'row', 'col', 'lit', 'x0', 'x1', 'y0', 'y1')}
+        yBase = h - (numLayers * 15)
+
+        for i in range(numLayers - 1, -1, -1):
+            layer = self.renderer.buildingsData[i]
+            for buildingId in range(bisect_left(layer.x, w)):
+                x, buildingWidth = layer.x[buildingId], layer.width[buildingId]
+                yTop = yBase - layer.height[buildingId]
+                windowStyle = windowStyles[layer.style[buildingId]]
+
+                rows, cols, colSpans, rowSpans = windowGrid(windowStyle, x, yTop, buildingWidth, h - yTop)
+                rowStarts = rowSpans[0].reshape(rows, -1).min(axis=1)
+                rowEnds = rowSpans[1].reshape(rows, -1).max(axis=1)
+
+                columns['layer'].append(np.full(rows * cols, i))
+                columns['building'].append(np.full(rows * cols, buildingId))
+                columns['row'].append(np.arange(rows).repeat(cols))
+                columns['col'].append(np.tile(np.arange(cols), rows))
+                columns['lit'].append(layer.windowLitGrid(buildingId)[:rows].ravel())
+                columns['x0'].append(np.tile(colSpans[0], rows))
+                columns['x1'].append(np.tile(colSpans[1], rows))
+                columns['y0'].append(rowStarts.repeat(cols))
+                columns['y1'].append(rowEnds.repeat(cols))
+            yBase += 20
+
+        windows = {name: np.concatenate(values) if values else np.empty(0, dtype=np.int64)
+                   for name, values in columns.items()}
+        windows['x0'] = np.maximum(windows['x0'], 0)
+        windows['y0'] = np.maximum(windows['y0'], 0)
+        windows['x1'] = np.minimum(windows['x1'], w - 1)
+        windows['y1'] = np.minimum(windows['y1'], h - 1)
+
+        onCanvas = (windows['x0'] <= windows['x1']) & (windows['y0'] <= windows['y1'])
+        self.windows = {name: values[onCanvas] for name, values in windows.items()}
+        self.windows['lit'] = self.windows['lit'].astype(bool)
+
+    def findRoofLights(self):
+        # one group per building with roof lights, back to front: its bounds and which pixels in them its lights
+        # show on when nothing nearer does. lights of different layers can overlap, so every pixel counts how
+        # many groups showing there are on and goes back to the unlit scene only once none are
+        self.lights = []
+        if self.unlitFrame is None:
+            return
+
+        w, h = self.size
+        self.lightsShowing = np.zeros((h, w), dtype=np.uint8)
+        yBase = h - (numLayers * 15)
+        for i in range(numLayers - 1, -1, -1):
+            layer = self.renderer.buildingsData[i]
+            for buildingId in range(bisect_left(layer.x, w)):
+                lightPositions = roofLightPositions(layer.x[buildingId], layer.width[buildingId])
+                if layer.roofLights[buildingId] != 1 or not lightPositions:
+                    continue
+
+                yTop = yBase - layer.height[buildingId]
+                y0, y1 = max(0, yTop - roofLightHeight - roofLightSize), min(h - 1, yTop - roofLightHeight)
+                x0, x1 = max(0, lightPositions[0]), min(w - 1, lightPositions[-1] + roofLightSize)
+                if x0 > x1 or y0 > y1:
+                    continue
+
+                # a nearer building can hide part of a light, the unlit scene's palette indices say which layer
+                # is in front at each pixel and the sky counts as behind every layer
+                mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+                for lightX in lightPositions:
+                    mask[:, max(0, lightX - x0):lightX - x0 + roofLightSize + 1] = True
+                mask &= (self.unlitFrame[y0:y1 + 1, x0:x1 + 1] - 1) // 3 >= i
+                self.lightsShowing[y0:y1 + 1, x0:x1 + 1] += mask
+                self.lights.append((x0, y0, x1, y1, mask))
+            yBase += 20
+
+        self.lightPeriods = self.generator.integers(roofLightBlinkTicks[0], roofLightBlinkTicks[1] + 1, len(self.lights))
+        self.lightPhases = self.generator.integers(0, self.lightPeriods) if self.lights else self.lightPeriods
+        self.lightOn = np.ones(len(self.lights), dtype=bool)
+
+    def tick(self):
+        # advances the animation one step, returns the (x, y, w, h) rects that were repainted
+        self.ticks += 1
+        dirtyRects = []
+        frames = [frame for frame in (self.frame, self.unlitFrame) if frame is not None]
+        windows = self.windows
+
+        windowCount = len(windows['lit'])
+        flips = max(1, round(windowCount * flickerRate)) if windowCount else 0
+        for k in np.unique(self.generator.integers(0, windowCount, flips)):
+            layerIndex, lit = int(windows['layer'][k]), not windows['lit'][k]
+            windows['lit'][k] = lit
+            self.renderer.buildingsData[layerIndex].toggleWindowLit(
+                int(windows['building'][k]), int(windows['row'][k]), int(windows['col'][k]))
+
+            # inside a window's bounds only its own pixels use its layer's window colours
+            onIndex = layerPaletteIndex(layerIndex) + 1
+            x0, x1, y0, y1 = windows['x0'][k], windows['x1'][k] + 1, windows['y0'][k], windows['y1'][k] + 1
+            for frame in frames:
+                region = frame[y0:y1, x0:x1]
+                region[(region == onIndex) | (region == onIndex + 1)] = onIndex if lit else onIndex + 1
+            dirtyRects.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+
+        if self.lights:
+            for group in np.flatnonzero((self.ticks + self.lightPhases) % self.lightPeriods == 0):
+                x0, y0, x1, y1, mask = self.lights[group]
+                self.lightOn[group] = not self.lightOn[group]
+                showing = self.lightsShowing[y0:y1 + 1, x0:x1 + 1]
+                if self.lightOn[group]:
+                    showing[mask] += 1
+                else:
+                    showing[mask] -= 1
 
-    # building drawing 
+                # a pixel another group's light still covers keeps showing a light
+                region = self.frame[y0:y1 + 1, x0:x1 + 1]
+                region[mask] = np.where(showing[mask] > 0, roofLightIndex, self.unlitFrame[y0:y1 + 1, x0:x1 + 1][mask])
+                dirtyRects.append((x0, y0, x1 - x0 + 1, y1 - y0 + 1))
 
-    yBase = h - (numLayers * 15)
+        return dirtyRects
 
-    for i in range(numLayers - 1, -1, -1):
-        drawBuildings(draw, yBase, originalBuildingColors[i], i, originalBuildingsData[i], h)
-        yBase += 20
 
+def imageFromPixels(pixels, palette):
+    # a pillow image of generateCityPixels output, palette scenes share the pixel buffer rather than copying it
+    if palette is None:
+        return Image.fromarray(pixels, "RGB")
+    img = Image.frombuffer("P", (pixels.shape[1], pixels.shape[0]), pixels, "raw", "P", 0, 1)
+    img.putpalette(palette)
     return img
 
 
-def drawControlPanel(screen, panelRect):
-    buttonGrey = (100, 100, 110)
-    panelGrey = (80, 80, 85)
-    borderGrey = (120, 120, 125)
-    
-    # draw panel background and border
-    pygame.draw.rect(screen, panelGrey, panelRect)
-    pygame.draw.rect(screen, borderGrey, panelRect, 2)
-    
-    buttonWidth = 120
-    buttonHeight = 40
-    buttonSpacing = 15
-    buttonY = panelRect.top + (panelRect.height - buttonHeight) // 2
-    
-    # center buttons in panel
-    totalButtonsWidth = (buttonWidth * 4) + (buttonSpacing * 3)
-    startX = panelRect.left + (panelRect.width - totalButtonsWidth) // 2
-    
-    refreshAllRect = pygame.Rect(startX, buttonY, buttonWidth, buttonHeight)
-    refreshColorsRect = pygame.Rect(startX + buttonWidth + buttonSpacing, buttonY, buttonWidth, buttonHeight)
-    refreshBuildingsRect = pygame.Rect(startX + 2 * (buttonWidth + buttonSpacing), buttonY, buttonWidth, buttonHeight)
-    exportImageRect = pygame.Rect(startX + 3 * (buttonWidth + buttonSpacing), buttonY, buttonWidth, buttonHeight)
-    
-    pygame.draw.rect(screen, buttonGrey, refreshAllRect)
-    pygame.draw.rect(screen, buttonGrey, refreshColorsRect)
-    pygame.draw.rect(screen, buttonGrey, refreshBuildingsRect)
-    pygame.draw.rect(screen, buttonGrey, exportImageRect)
-    
-    font = pygame.font.Font(None, 24)
-    
-    # render text for each button
-    textRefreshAll = font.render("Refresh All", True, (255, 255, 255))
-    textRectAll = textRefreshAll.get_rect(center=refreshAllRect.center)
-    screen.blit(textRefreshAll, textRectAll)
-    
-    textRefreshColors = font.render("New Colours", True, (255, 255, 255))
-    textRectColors = textRefreshColors.get_rect(center=refreshColorsRect.center)
-    screen.blit(textRefreshColors, textRectColors)
-    
-    textRefreshBuildings = font.render("New Buildings", True, (255, 255, 255))
-    textRectBuildings = textRefreshBuildings.get_rect(center=refreshBuildingsRect.center)
-    screen.blit(textRefreshBuildings, textRectBuildings)
-    
-    textExportImage = font.render("Export PNG", True, (255, 255, 255))
-    textRectExport = textExportImage.get_rect(center=exportImageRect.center)
-    screen.blit(textExportImage, textRectExport)
-    
-    return refreshAllRect, refreshColorsRect, refreshBuildingsRect, exportImageRect
-
+class RenderWorker:
+    # renders on a background thread so the window stays responsive. a request that hasn't started yet is
+    # merged into the next one, a finished render is dropped if a newer request came in while it was drawing,
+    # and while idle the worker renders the next "Refresh All" scene ahead of time
+    def __init__(self, renderer=None, onResult=None, prefetch=True):
+        # the worker owns the renderer from here on, onResult is called from the worker thread
+        self.renderer = renderer if renderer is not None else CityRenderer()
+        self.onResult = onResult
+        self.prefetch = prefetch
+        self.condition = threading.Condition()
+        self.pending = None  # (w, h, refreshColors, refreshBuildings) waiting to be rendered
+        self.generation = 0  # bumped by every request, a render only counts if it's still the latest
+        self.result = None
+        self.resultStats = None  # render stats of the newest finished result
+        self.size = None
+        self.nextScene = None  # (renderer, size, pixels and palette) for the next "Refresh All"
+        self.closed = False
+        # held while the worker touches its renderer, anyone else using it takes it too
+        self.renderLock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, w, h, refreshColors=False, refreshBuildings=False):
+        with self.condition:
+            if self.pending is not None:
+                # the pending request never started, keep what it asked for but draw at the newest size
+                refreshColors = refreshColors or self.pending[2]
+                refreshBuildings = refreshBuildings or self.pending[3]
+            self.pending = (w, h, refreshColors, refreshBuildings)
+            self.size = (w, h)
+            self.generation += 1
+            self.condition.notify()
+
+    def takeResult(self):
+        # the newest finished (pixels, palette), or None if nothing new is ready
+        with self.condition:
+            result, self.result = self.result, None
+            return result
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def wantsNextScene(self):
+        return self.prefetch and self.size is not None and (self.nextScene is None or self.nextScene[1] != self.size)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and self.pending is None and not self.wantsNextScene():
+                    self.condition.wait()
+                if self.closed:
+                    return
+                job, self.pending = self.pending, None
+                generation, size = self.generation, self.size
+
+            if job is None:
+                self.prefetchScene(size)
+                continue
+
+            with self.renderLock:
+                result = self.render(*job)
+            with self.condition:
+                current = generation == self.generation
+                if current:
+                    self.result = result
+                    self.resultStats = self.renderer.lastStats
+            if current and self.onResult is not None:
+                self.onResult()
+
+    def render(self, w, h, refreshColors, refreshBuildings):
+        nextScene = self.nextScene
+        if refreshColors and refreshBuildings and nextScene is not None and nextScene[1] == (w, h):
+            self.renderer, _, result = nextScene
+            self.nextScene = None
+            return result
+        return self.renderer.generateCityPixels(w, h, refreshColors, refreshBuildings)
+
+    def prefetchScene(self, size):
+        # an independent scene built the way "Refresh All" builds one, seeded from the current renderer
+        w, h = size
+        with self.renderLock:
+            seed = self.renderer.rng.getrandbits(64)
+        scene = CityRenderer(seed)
+        scene.updateScene(w, h)
+        result = scene.generateCityPixels(w, h, refreshBuildings=True)
+        self.nextScene = (scene, size, result)
+
+
+def exportImage(img, imageFormat=exportFormat, compressLevel=exportCompressLevel, optimize=exportOptimize, directory="exports", scales=None):
+    # with scales, one file per whole number upscale of img and their filenames in the same order
+    if scales is None:
+        return encodeExport(img, imageFormat, compressLevel, optimize, directory)['filename']
+    return [result['filename'] for result in encodeScaledExports(img, scales, imageFormat, compressLevel, optimize, directory)]
+
+
+def upscaleImage(img, scale):
+    # every pixel becomes a scale x scale block, the pixel art stays crisp and nothing is drawn again
+    if scale == 1:
+        return img
+    return img.resize((img.width * scale, img.height * scale), Image.NEAREST)
+
+
+def encodeImage(img, imageFormat="png", compressLevel=6, optimize=False):
+    # the image as png or lossless webp bytes, palette images are written as rgb
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if imageFormat == "webp":
+        # lossless webp reads quality as how hard to try, method 6 is its slowest and smallest
+        options = {'lossless': True, 'quality': compressLevel * 100 // 9, 'method': 6 if optimize else 4}
+    else:
+        options = {'compress_level': compressLevel, 'optimize': optimize}
 
-def convertPillowToPygame(pilImg):
-    pilImg = pilImg.convert("RGBA")
-    mode = pilImg.mode
-    size = pilImg.size
-    data = pilImg.tobytes()
-    return pygame.image.fromstring(data, size, mode)
+    encoded = io.BytesIO()
+    img.save(encoded, format=imageFormat.upper(), **options)
+    return encoded.getbuffer()
 
 
-def exportImage(img):
+def encodeExport(img, imageFormat="png", compressLevel=6, optimize=False, directory="exports", scale=1, timestamp=None):
     # images are saved in exports folder, create exports directory if it doesn't exist
-    if not os.path.exists("exports"):
-        os.makedirs("exports")
-
+    os.makedirs(directory, exist_ok=True)
+
+    startTime = time.perf_counter()
+    data = encodeImage(upscaleImage(img, scale), imageFormat, compressLevel, optimize)
+    encodeTime = time.perf_counter() - startTime
+
+    filename = writeExportFile(directory, imageFormat, data, f"@{scale}x" if scale != 1 else "", timestamp)
+    return {
+        'filename': filename,
+        'bytes': len(data),
+        'encodeSeconds': encodeTime,
+        'totalSeconds': time.perf_counter() - startTime,
+    }
+
+
+def encodeScaledExports(img, scales, imageFormat="png", compressLevel=6, optimize=False, directory="exports"):
+    # each scale is upscaled and encoded on its own thread, compression releases the gil so they run side by side.
+    # the upscale happens in the thread too, so only the scales being encoded are held in memory at once
+    if img.mode != "RGB":
+        img = img.convert("RGB")  # once here rather than at every scale
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"exports/city_{timestamp}.png"
-    img.save(filename)
-    return filename
-
-
-# initialize pygame and create window
-pygame.init()
-pygame.display.set_caption("Pixel Art City Generator")
-initialWidth = width
-initialHeight = height
-screenWidth = initialWidth
-screenHeight = initialHeight + controlPanelHeight
-screen = pygame.display.set_mode((screenWidth, screenHeight), pygame.RESIZABLE)
-
-# generate initial image
-img = generateCityImage(initialWidth, initialHeight)
-pygameImage = convertPillowToPygame(img)
-
-# main game loop
-running = True
-currentImageWidth = initialWidth
-currentImageHeight = initialHeight
-
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-        if event.type == pygame.VIDEORESIZE:
-            # handle window resize
-            screenWidth = max(event.w, minWidth)
-            screenHeight = max(event.h, minHeight + controlPanelHeight)
-            screen = pygame.display.set_mode((screenWidth, screenHeight), pygame.RESIZABLE)
-            currentImageHeight = screenHeight - controlPanelHeight
-            currentImageWidth = screenWidth
-            img = generateCityImage(currentImageWidth, currentImageHeight)
-            pygameImage = convertPillowToPygame(img)
-
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            # handle button clicks
-            mouseX, mouseY = pygame.mouse.get_pos()
-            panelRect = pygame.Rect(0, currentImageHeight, screenWidth, controlPanelHeight)
-            refreshAllRect, refreshColorsRect, refreshBuildingsRect, exportImageRect = drawControlPanel(screen, panelRect)
-            
-            if refreshAllRect.collidepoint(mouseX, mouseY):
-                windowsData = {}
-                img = generateCityImage(currentImageWidth, currentImageHeight, 
-                refreshColors=True, refreshBuildings=True)
-                pygameImage = convertPillowToPygame(img)
-            
-            elif refreshColorsRect.collidepoint(mouseX, mouseY):
-                img = generateCityImage(currentImageWidth, currentImageHeight, 
-                refreshColors=True, refreshBuildings=False)
-                pygameImage = convertPillowToPygame(img)
-                
-            elif refreshBuildingsRect.collidepoint(mouseX, mouseY):
-                windowsData = {}
-                img = generateCityImage(currentImageWidth, currentImageHeight, 
-                refreshColors=False, refreshBuildings=True)
-                pygameImage = convertPillowToPygame(img)
-                
-            elif exportImageRect.collidepoint(mouseX, mouseY):
-                savedFilename = exportImage(img)
-                print(f"Image exported to {savedFilename}")
 
-    screen.fill((50, 50, 55))  # background color
-    screen.blit(pygameImage, (0, 0))
-    panelRect = pygame.Rect(0, currentImageHeight, screenWidth, controlPanelHeight)
-    drawControlPanel(screen, panelRect)
-    pygame.display.flip()  # update display
+    with ThreadPoolExecutor(max_workers=min(len(scales), os.cpu_count() or 1), thread_name_prefix="scale") as pool:
+        # biggest first, it takes longest
+        futures = {scale: pool.submit(encodeExport, img, imageFormat, compressLevel, optimize, directory, scale, timestamp)
+                   for scale in sorted(set(scales), reverse=True)}
+        return [dict(futures[scale].result(), scale=scale) for scale in scales]
+
+
+def writeExportFile(directory, extension, data, label="", timestamp=None):
+    # files are created exclusively, so exports in the same second get a _2, _3... suffix instead of overwriting
+    timestamp = timestamp or datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    sequence = 1
+    while True:
+        suffix = f"_{sequence}" if sequence > 1 else ""
+        filename = os.path.join(directory, f"city_{timestamp}{label}{suffix}.{extension}")
+        try:
+            with open(filename, "xb") as file:
+                file.write(data)
+            return filename
+        except FileExistsError:
+            sequence += 1
+
+
+class ExportQueue:
+    # encodes and writes exports on a thread pool so the window never waits on compression or the disk
+    def __init__(self, imageFormat=exportFormat, compressLevel=exportCompressLevel, optimize=exportOptimize,
+                 directory="exports", workers=exportWorkers, onDone=None, scales=exportScales):
+        # onDone gets each export's stats, a list of them with scales, (or the exception it raised) on a pool thread
+        self.settings = (imageFormat, compressLevel, optimize, directory)
+        self.scales = scales
+        self.onDone = onDone if onDone is not None else reportExport
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+
+    def submit(self, img):
+        if self.scales is not None:
+            future = self.pool.submit(encodeScaledExports, img, self.scales, *self.settings)
+        else:
+            future = self.pool.submit(encodeExport, img, *self.settings)
+        future.add_done_callback(lambda done: self.onDone(done.exception() or done.result()))
+        return future
+
+    def close(self):
+        # waits for queued exports so nothing is lost on exit
+        self.pool.shutdown(wait=True)
+
+
+def reportExport(result):
+    if isinstance(result, Exception):
+        print(f"Export failed: {result}")
+        return
+    if isinstance(result, list):
+        for scaled in result:
+            reportExport(scaled)
+        return
+    print(f"Image exported to {result['filename']} ({result['bytes']} bytes, "
+          f"encoded in {result['encodeSeconds'] * 1000:.0f} ms)")
+
 
-pygame.quit()
\ No newline at end of file
+if __name__ == "__main__":
+    # the window lives in city_gui, so importing the generator never loads pygame. city_gui is handed this
+    # module as the generator, otherwise its import would run the whole file again for a second copy
+    import sys
+    sys.modules.setdefault("city_generator", sys.modules["__main__"])
+    import city_gui
+    city_gui.main()
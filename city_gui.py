@@ -0,0 +1,331 @@
+import argparse
+import time
+from functools import lru_cache
+
+# taken before pygame and the generator load, so the startup time includes importing them
+launchTime = time.perf_counter()
+
+import numpy as np
+import pygame
+
+from city_generator import (ExportQueue, RenderWorker, WindowAnimator, animationFps, controlPanelHeight,
+                            defaultRenderer, height, imageFromPixels, maxFrameRate, minHeight, minWidth,
+                            resizeSettleTime, width)
+
+buttonLabels = ["Refresh All", "New Colours", "New Buildings", "Export PNG"]
+buildingEditButtons = (1, 3, 4, 5)  # left click, right click, wheel up, wheel down
+buildingHeightStep = 10
+
+
+@lru_cache(maxsize=1)
+def panelFont():
+    # loading a font reads it from disk, so the panel keeps the one it made
+    return pygame.font.Font(None, 24)
+
+
+def controlPanelButtons(panelRect):
+    buttonWidth = 120
+    buttonHeight = 40
+    buttonSpacing = 15
+    buttonY = panelRect.top + (panelRect.height - buttonHeight) // 2
+    
+    # center buttons in panel
+    totalButtonsWidth = (buttonWidth * 4) + (buttonSpacing * 3)
+    startX = panelRect.left + (panelRect.width - totalButtonsWidth) // 2
+    
+    refreshAllRect = pygame.Rect(startX, buttonY, buttonWidth, buttonHeight)
+    refreshColorsRect = pygame.Rect(startX + buttonWidth + buttonSpacing, buttonY, buttonWidth, buttonHeight)
+    refreshBuildingsRect = pygame.Rect(startX + 2 * (buttonWidth + buttonSpacing), buttonY, buttonWidth, buttonHeight)
+    exportImageRect = pygame.Rect(startX + 3 * (buttonWidth + buttonSpacing), buttonY, buttonWidth, buttonHeight)
+    
+    return refreshAllRect, refreshColorsRect, refreshBuildingsRect, exportImageRect
+
+
+@lru_cache(maxsize=4)
+def controlPanelSurface(panelWidth):
+    # the panel only changes with the window width, so it's drawn once per width and blitted after that
+    buttonGrey = (100, 100, 110)
+    panelGrey = (80, 80, 85)
+    borderGrey = (120, 120, 125)
+
+    surface = pygame.Surface((panelWidth, controlPanelHeight))
+    panelRect = surface.get_rect()
+    
+    # draw panel background and border
+    pygame.draw.rect(surface, panelGrey, panelRect)
+    pygame.draw.rect(surface, borderGrey, panelRect, 2)
+    
+    # render text for each button
+    font = panelFont()
+    for buttonRect, label in zip(controlPanelButtons(panelRect), buttonLabels):
+        pygame.draw.rect(surface, buttonGrey, buttonRect)
+        text = font.render(label, True, (255, 255, 255))
+        surface.blit(text, text.get_rect(center=buttonRect.center))
+    
+    return surface
+
+
+def drawControlPanel(screen, panelRect):
+    screen.blit(controlPanelSurface(panelRect.width), panelRect.topleft)
+    return controlPanelButtons(panelRect)
+
+
+def convertPillowToPygame(pilImg):
+    # palette images stay 8 bit, anything else goes over as plain rgb, there's no alpha to carry
+    if pilImg.mode == "P":
+        return convertPixelsToPygame(np.asarray(pilImg), pilImg.getpalette())
+    if pilImg.mode != "RGB":
+        pilImg = pilImg.convert("RGB")
+    return pygame.image.frombuffer(pilImg.tobytes(), pilImg.size, "RGB")
+
+
+def convertPixelsToPygame(pixels, palette):
+    # the surface wraps the pixel buffer instead of copying it, and keeps it alive for as long as it's used
+    size = (pixels.shape[1], pixels.shape[0])
+    if palette is None:
+        return pygame.image.frombuffer(pixels, size, "RGB")
+
+    surface = pygame.image.frombuffer(pixels, size, "P")
+    surface.set_palette(list(zip(palette[0::3], palette[1::3], palette[2::3])))
+    return surface
+
+
+def editBuildingUnder(renderer, pixels, x, y, button):
+    # left click re-rolls the windows of the building under (x, y), right click toggles its roof lights and the
+    # wheel makes it taller or shorter. the change is copied into pixels, returns the (x, y, w, h) rect it covered
+    h, w = pixels.shape[:2]
+    hit = renderer.buildingUnder(x, y, h)
+    if hit is None:
+        return None
+
+    layerIndex, buildingId = hit
+    if button in (4, 5):
+        step = buildingHeightStep if button == 4 else -buildingHeightStep
+        edit = {'height': renderer.buildingsData[layerIndex].height[buildingId] + step}
+    else:
+        edit = {'rerollWindows': button == 1, 'toggleRoofLights': button == 3}
+
+    edited = renderer.editBuilding(w, h, layerIndex, buildingId, **edit)
+    if edited is None:
+        # the cached render is gone (an animation clears it), so the whole scene is drawn again
+        edited = (0, 0, renderer.generateCityPixels(w, h)[0])
+
+    editX, editY, region = edited
+    pixels[editY:editY + region.shape[0], editX:editX + region.shape[1]] = region
+    return editX, editY, region.shape[1], region.shape[0]
+
+
+def drawStatsOverlay(screen, renderStats, frameStats):
+    # frame timings from the window and the stage timings of the render on screen, in the top left corner
+    lines = [f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in frameStats.items()]
+    if renderStats is not None:
+        lines.append(f"render {renderStats['totalSeconds'] * 1000:.1f} ms")
+        lines += [f"  {stage} {seconds * 1000:.1f} ms" for stage, seconds in renderStats['seconds'].items()]
+        lines += [f"{name} {count}" for name, count in renderStats['counts'].items()]
+
+    font = panelFont()
+    lineHeight = font.get_linesize()
+    background = pygame.Surface((170, lineHeight * len(lines) + 8), pygame.SRCALPHA)
+    background.fill((0, 0, 0, 160))
+    screen.blit(background, (4, 4))
+
+    for i, line in enumerate(lines):
+        screen.blit(font.render(line, True, (255, 255, 255)), (8, 8 + i * lineHeight))
+
+
+def drawScreen(screen, pygameImage, imageHeight):
+    screen.fill((50, 50, 55))  # background color
+    if pygameImage is not None:
+        screen.blit(pygameImage, (0, 0))
+    drawControlPanel(screen, pygame.Rect(0, imageHeight, screen.get_width(), controlPanelHeight))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate pixel art city skylines in a window.")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="print how long the first city took to appear on screen, then quit")
+    args = parser.parse_args(argv)
+
+    # only the parts of pygame the window uses are started, pygame.init would open audio and joysticks too
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_caption("Pixel Art City Generator")
+    initialWidth = width
+    initialHeight = height
+    screenWidth = initialWidth
+    screenHeight = initialHeight + controlPanelHeight
+    screen = pygame.display.set_mode((screenWidth, screenHeight), pygame.RESIZABLE)
+
+    # nothing reacts to the mouse moving, so motion events shouldn't wake the loop
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
+    clock = pygame.time.Clock()
+
+    # scenes are rendered in the background and shown when they're ready, the worker posts an event to wake the loop
+    renderDoneEvent = pygame.event.custom_type()
+    worker = RenderWorker(defaultRenderer, lambda: pygame.event.post(pygame.event.Event(renderDoneEvent)))
+    worker.request(initialWidth, initialHeight)
+    pygameImage = None
+    displayed = None  # pixels and palette behind pygameImage, kept for exporting
+    showStats = False  # F3 toggles the timing overlay
+    animator = None  # A toggles flickering windows on the displayed scene
+    animationTickEvent = pygame.event.custom_type()
+    renderStats = None
+    frameStats = {'frame': 0.0, 'display': 0.0, 'flip': 0.0}
+    exportQueue = ExportQueue()
+
+    # main game loop
+    running = True
+    currentImageWidth = initialWidth
+    currentImageHeight = initialHeight
+    pendingSize = None  # window size waiting for a drag to settle before the city is regenerated
+    resizeDeadline = 0
+    dirtyRects = [screen.get_rect()]
+
+    while running:
+        # sleep until an event arrives, or until a pending resize has had time to settle
+        timeout = max(1, resizeDeadline - pygame.time.get_ticks()) if pendingSize else 0
+        events = [pygame.event.wait(timeout)] + pygame.event.get()
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+
+            if event.type == pygame.VIDEORESIZE:
+                # every step of a drag lands here, only the last size gets a new city
+                pendingSize = (max(event.w, minWidth), max(event.h, minHeight + controlPanelHeight))
+                resizeDeadline = pygame.time.get_ticks() + resizeSettleTime
+                screen = pygame.display.get_surface()
+                dirtyRects = [screen.get_rect()]
+
+            if event.type == pygame.WINDOWEXPOSED:
+                dirtyRects = [screen.get_rect()]
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                showStats = not showStats
+                dirtyRects = [screen.get_rect()]
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_a and displayed is not None:
+                if animator is None:
+                    # the animator changes the worker's scene, so it only touches it while the worker isn't
+                    with worker.renderLock:
+                        try:
+                            animator = WindowAnimator(worker.renderer, currentImageWidth, currentImageHeight)
+                        except ValueError as error:
+                            print(error)
+                    if animator is not None:
+                        pygameImage = convertPixelsToPygame(animator.frame, animator.palette)
+                        dirtyRects.append(pygameImage.get_rect())
+                        pygame.time.set_timer(animationTickEvent, 1000 // animationFps)
+                else:
+                    # the scene stays as the animation left it, so that's what edits and exports start from
+                    displayed = (animator.frame.copy(), animator.palette)
+                    pygameImage = convertPixelsToPygame(*displayed)
+                    animator = None
+                    pygame.time.set_timer(animationTickEvent, 0)
+
+            if event.type == animationTickEvent and animator is not None:
+                # the surface wraps the animation frame, so only the repainted windows and lights need updating
+                with worker.renderLock:
+                    dirtyRects += [pygame.Rect(rect) for rect in animator.tick()]
+
+            if event.type == renderDoneEvent:
+                # the previous image stays up until the new one is ready, displayed straight from its palette indices
+                result = worker.takeResult()
+                if result is not None:
+                    displayStart = time.perf_counter()
+                    displayed = result
+                    renderStats = worker.resultStats
+                    pygameImage = convertPixelsToPygame(*displayed)
+                    frameStats['display'] = time.perf_counter() - displayStart
+                    dirtyRects.append(pygameImage.get_rect())
+
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                # handle button clicks
+                mouseX, mouseY = event.pos
+                panelRect = pygame.Rect(0, currentImageHeight, screenWidth, controlPanelHeight)
+                refreshAllRect, refreshColorsRect, refreshBuildingsRect, exportImageRect = controlPanelButtons(panelRect)
+                refresh = None
+            
+                if refreshAllRect.collidepoint(mouseX, mouseY):
+                    refresh = {'refreshColors': True, 'refreshBuildings': True}
+            
+                elif refreshColorsRect.collidepoint(mouseX, mouseY):
+                    refresh = {'refreshColors': True, 'refreshBuildings': False}
+                
+                elif refreshBuildingsRect.collidepoint(mouseX, mouseY):
+                    refresh = {'refreshColors': False, 'refreshBuildings': True}
+                
+                elif mouseY < currentImageHeight and event.button in buildingEditButtons and displayed is not None:
+                    # clicking the city edits the building under the cursor, only the rect it covers is drawn again.
+                    # tall skies are drawn in rgb and have no cached palette render to patch
+                    if displayed[1] is not None:
+                        if animator is not None:
+                            displayed = (animator.frame.copy(), animator.palette)
+                        animator = None
+                        pygame.time.set_timer(animationTickEvent, 0)
+                        if not displayed[0].flags.writeable:
+                            # renders drawn with pillow come back as a read-only view of the image's bytes
+                            displayed = (displayed[0].copy(), displayed[1])
+                        with worker.renderLock:
+                            edited = editBuildingUnder(worker.renderer, displayed[0], mouseX, mouseY, event.button)
+                        if edited is not None:
+                            pygameImage = convertPixelsToPygame(*displayed)
+                            dirtyRects.append(pygame.Rect(edited))
+
+                elif exportImageRect.collidepoint(mouseX, mouseY) and displayed is not None:
+                    # exports what's on screen, the renderer belongs to the worker thread. an animation keeps
+                    # changing its frame and edits patch the displayed pixels in place while the export is
+                    # encoded on another thread, so the export gets a copy either way
+                    if animator is not None:
+                        exportQueue.submit(imageFromPixels(animator.frame.copy(), animator.palette))
+                    else:
+                        exportQueue.submit(imageFromPixels(displayed[0].copy(), displayed[1]))
+
+                if refresh is not None:
+                    # a new scene ends the animation, the worker picks up the windows as they were left
+                    animator = None
+                    pygame.time.set_timer(animationTickEvent, 0)
+                    worker.request(currentImageWidth, currentImageHeight, **refresh)
+
+        if pendingSize and pygame.time.get_ticks() >= resizeDeadline:
+            # handle window resize
+            screenWidth, screenHeight = pendingSize
+            pendingSize = None
+            screen = pygame.display.set_mode((screenWidth, screenHeight), pygame.RESIZABLE)
+            currentImageHeight = screenHeight - controlPanelHeight
+            currentImageWidth = screenWidth
+            animator = None
+            pygame.time.set_timer(animationTickEvent, 0)
+            worker.request(currentImageWidth, currentImageHeight)
+            dirtyRects = [screen.get_rect()]
+
+        if dirtyRects:
+            # a refresh only touches the image, anything else repaints the whole window
+            frameStart = time.perf_counter()
+            if screen.get_rect() in dirtyRects:
+                drawScreen(screen, pygameImage, currentImageHeight)
+            else:
+                screen.blit(pygameImage, (0, 0))
+            if showStats:
+                drawStatsOverlay(screen, renderStats, frameStats)
+
+            flipStart = time.perf_counter()
+            pygame.display.update(dirtyRects)
+            dirtyRects = []
+            frameStats['flip'] = time.perf_counter() - flipStart
+            frameStats['frame'] = time.perf_counter() - frameStart
+
+            if args.startup_time and displayed is not None:
+                print(f"First frame {(time.perf_counter() - launchTime) * 1000:.0f} ms after launch")
+                running = False
+
+            # clicks and resize steps can arrive faster than it's worth repainting
+            clock.tick(maxFrameRate)
+
+    worker.close()
+    exportQueue.close()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def fetch(url, timeout=120):
+    # (status, bytes received, seconds)
+    startTime = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as error:
+        size = len(error.read())
+        status = error.code
+    return status, size, time.perf_counter() - startTime
+
+
+def runLoadTest(baseUrl, requests=200, concurrency=8, seeds=20, w=1920, h=1080, imageFormat="png", seed=0):
+    # concurrency clients sharing `requests` renders, seeds picked from a pool of `seeds` so repeats hit the
+    # cache or coalesce with a render already in flight
+    picker = random.Random(seed)
+    urls = [f"{baseUrl}/render?seed={picker.randrange(seeds)}&w={w}&h={h}&format={imageFormat}" for _ in range(requests)]
+    results = []
+    lock = threading.Lock()
+    nextIndex = [0]
+
+    def client():
+        while True:
+            with lock:
+                if nextIndex[0] >= len(urls):
+                    return
+                url = urls[nextIndex[0]]
+                nextIndex[0] += 1
+            result = fetch(url)
+            with lock:
+                results.append(result)
+
+    startTime = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - startTime
+
+    latencies = sorted(seconds for status, _, seconds in results if status == 200)
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else None
+
+    return {
+        'requests': len(results),
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requestsPerSecond': len(results) / elapsed if elapsed > 0 else 0.0,
+        'megabytesPerSecond': sum(size for _, size, _ in results) / elapsed / 1e6 if elapsed > 0 else 0.0,
+        'statuses': statuses,
+        'latencySeconds': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                           'max': latencies[-1] if latencies else None},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running city render server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seeds", type=int, default=20, help="distinct seeds requested, fewer means more cache hits")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--format", default="png")
+    args = parser.parse_args(argv)
+
+    result = runLoadTest(args.url, args.requests, args.concurrency, args.seeds, args.width, args.height, args.format)
+    print(json.dumps(result, indent=2))
+
+    with urllib.request.urlopen(f"{args.url}/metrics") as response:
+        metrics = json.load(response)
+    print(f"server: {json.dumps(metrics['sources'])}, cache hit rate {metrics['cache']['hitRate']:.0%}, "
+          f"p95 {metrics['latencySeconds']['p95']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import city_generator
+
+panStripWidth = 512  # columns rendered at a time as the camera moves
+panSpareStrips = 4  # strips the band holds beyond the viewport, the band only slides once they're used up
+iovMax = 1024  # most buffers one writev call takes on linux and macos
+
+
+class PanoramaPan:
+    # frames of a w x h camera moving across a panoramaWidth wide scene. the layout is made once, then column
+    # strips are rendered into a band as the camera reaches them, and every frame is a view of the band.
+    # strips the camera has left behind are dropped when the band slides along, so memory stays at about
+    # one viewport plus panSpareStrips strips however wide the panorama is
+    def __init__(self, renderer, panoramaWidth, w, h, stripWidth=panStripWidth, spareStrips=panSpareStrips):
+        if w > panoramaWidth:
+            raise ValueError(f"a {w}px wide view doesn't fit in a {panoramaWidth}px wide panorama")
+
+        renderer.updateScene(panoramaWidth, h)
+        city_generator.checkIndexedHeight(renderer, h, "to pan across")
+
+        # every building's random state is settled up front so strips look the same whenever they're rendered
+        renderer.settleBuildings(h)
+        self.renderer = renderer
+        self.panoramaWidth = panoramaWidth
+        self.size = (w, h)
+        self.stripWidth = stripWidth
+        self.colors = np.array(renderer.scenePalette(h), dtype=np.uint8).reshape(256, 3)
+
+        self.band = np.empty((h, (math.ceil(w / stripWidth) + max(1, spareStrips)) * stripWidth, 3), dtype=np.uint8)
+        self.bandStart = 0  # panorama column of the band's first column
+        self.bandEnd = 0  # panorama column after the last one rendered into the band
+        self.stats = {'strips': 0, 'evicted': 0, 'slides': 0}
+
+    def frame(self, x):
+        # the (h, w, 3) view with its left edge at panorama column x, valid until the next frame is taken
+        w, h = self.size
+        x = max(0, min(int(x), self.panoramaWidth - w))
+        bandWidth = self.band.shape[1]
+
+        if x < self.bandStart or x + w > self.bandStart + bandWidth:
+            # slide the band so it starts at x's strip, keeping whatever's already rendered from there on
+            start = x // self.stripWidth * self.stripWidth
+            kept = max(0, self.bandEnd - start) if self.bandStart <= start else 0
+            if kept:
+                self.band[:, :kept] = self.band[:, start - self.bandStart:self.bandEnd - self.bandStart]
+            self.stats['evicted'] += math.ceil((self.bandEnd - self.bandStart - kept) / self.stripWidth)
+            self.stats['slides'] += 1
+            self.bandStart, self.bandEnd = start, start + kept
+
+        while self.bandEnd < x + w:
+            self.renderStrip()
+
+        offset = x - self.bandStart
+        return self.band[:, offset:offset + w]
+
+    def renderStrip(self):
+        h = self.size[1]
+        xStart = self.bandEnd
+        xEnd = min(xStart + self.stripWidth, self.panoramaWidth)
+        tile = self.renderer.renderIndexTile(xStart, xEnd, h).pixels
+        self.band[:, xStart - self.bandStart:xEnd - self.bandStart] = self.colors[tile]
+        self.bandEnd = xEnd
+        self.stats['strips'] += 1
+
+
+def panFrames(renderer, w, h, frames, speed, stripWidth=panStripWidth):
+    # frames of a camera panning right at speed px per frame, the panorama is made just wide enough for them
+    pan = PanoramaPan(renderer, w + math.ceil(speed * max(0, frames - 1)), w, h, stripWidth)
+    for index in range(frames):
+        yield pan.frame(index * speed)
+
+
+def writeFrame(fd, frame):
+    # every row of a frame is contiguous in the band, so the rows are handed to the kernel in gathered writes
+    # straight from it and the frame is never copied into one buffer
+    rows = [memoryview(row).cast("B") for row in frame]
+    for start in range(0, len(rows), iovMax):
+        pending = rows[start:start + iovMax]
+        while pending:
+            written = os.writev(fd, pending)
+            # a pipe can take less than everything, carry on from where it stopped
+            while pending and written >= len(pending[0]):
+                written -= len(pending[0])
+                pending.pop(0)
+            if pending and written:
+                pending[0] = pending[0][written:]
+
+
+def writeFrames(frames, file, fps=None):
+    # writes raw rgb frames to file, no faster than fps if it's given. returns how many went out and how fast
+    file.flush()
+    fd = file.fileno()
+    count = 0
+    startTime = time.perf_counter()
+
+    for frame in frames:
+        if fps:
+            # paced against the start, so a slow frame is made up for rather than pushing every later one back
+            wait = startTime + count / fps - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        writeFrame(fd, frame)
+        count += 1
+
+    # the rate is frame to frame, n frames paced at fps span n - 1 intervals
+    elapsed = time.perf_counter() - startTime
+    return {'frames': count, 'seconds': elapsed, 'fps': (count - 1) / elapsed if count > 1 and elapsed > 0 else 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pan a camera across a wide city skyline and write raw rgb frames.")
+    parser.add_argument("--width", type=int, default=1280, help="frame width")
+    parser.add_argument("--height", type=int, default=720, help="frame height")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the scene, random if not given")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the pan")
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate, frames are written no faster than this")
+    parser.add_argument("--unpaced", action="store_true", help="write frames as fast as they can be made")
+    parser.add_argument("--speed", type=float, default=2.0, help="pixels the camera moves per frame")
+    parser.add_argument("--strip-width", type=int, default=panStripWidth, help="columns rendered at a time")
+    parser.add_argument("--output", default="-", help="output file, - for stdout")
+    args = parser.parse_args(argv)
+
+    frames = panFrames(city_generator.CityRenderer(args.seed), args.width, args.height,
+                       round(args.seconds * args.fps), args.speed, args.strip_width)
+    fps = None if args.unpaced else args.fps
+    print(f"Writing rgb24 {args.width}x{args.height} frames at {args.fps:g} fps", file=sys.stderr)
+
+    try:
+        if args.output == "-":
+            result = writeFrames(frames, sys.stdout.buffer, fps)
+        else:
+            os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+            with open(args.output, "wb") as file:
+                result = writeFrames(frames, file, fps)
+    except BrokenPipeError:
+        # the encoder stopped reading, stdout is pointed at nothing so exiting doesn't complain a second time
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        print("Output closed early", file=sys.stderr)
+        return
+
+    print(f"Wrote {result['frames']} frames in {result['seconds']:.2f}s ({result['fps']:.1f} fps achieved)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+import numpy as np
+
+import city_generator
+
+# a scene file is a fixed header, the rng state, a (count, window bytes) entry per layer and then each layer's
+# columns in order. everything is little endian and every block starts on an 8 byte boundary, so the file
+# can be mapped and read as arrays in place
+sceneMagic = b"CITYSCN\0"
+sceneVersion = 1
+sceneHeader = struct.Struct("<8sIIIIiB3d3B3B")  # magic, version, layers, w, h, max height, dark, hsl, sky, roof light
+layerEntry = struct.Struct("<QQ")
+layerColumns = [
+    # (BuildingLayer attribute, file dtype)
+    ('x', '<i4'),
+    ('width', '<u2'),
+    ('height', '<u2'),
+    ('gap', 'u1'),
+    ('style', 'i1'),
+    ('roofLights', 'i1'),
+    ('windowOffset', '<i8'),
+    ('windowRows', '<u2'),
+    ('windowCols', '<u2'),
+]
+rngStateLength = 625  # mersenne twister words, the last one is the position in the state
+
+
+def aligned(offset):
+    return (offset + 7) & ~7
+
+
+def saveScene(renderer, filename, w, h):
+    # every random decision for a w x h render is settled first, so rendering the loaded scene at that size
+    # never needs the rng. the rng state is saved too, so anything drawn later matches the original process
+    renderer.updateScene(w, h)
+    renderer.settleBuildings(h)
+
+    rngVersion, rngWords, gaussNext = renderer.rng.getstate()
+    layers = renderer.buildingsData
+    for layer in layers:
+        layer.compactWindowBits()
+
+    with open(filename, "wb") as file:
+        file.write(sceneHeader.pack(
+            sceneMagic, sceneVersion, len(layers), w, h, renderer.maxBuildingHeight, renderer.isSkyDark,
+            *renderer.skyHsl, *renderer.skyColor, *renderer.roofLightColor))
+        file.write(bytes(np.array(renderer.buildingColors, dtype=np.uint8).reshape(-1)))
+        file.write(struct.pack("<d", float("nan") if gaussNext is None else gaussNext))
+        file.write(np.array(rngWords, dtype="<u4").tobytes())
+        for layer in layers:
+            file.write(layerEntry.pack(len(layer), len(layer.windowBits)))
+
+        for layer in layers:
+            for name, dtype in layerColumns:
+                file.write(b"\0" * (aligned(file.tell()) - file.tell()))
+                file.write(np.asarray(getattr(layer, name)).astype(dtype).tobytes())
+            file.write(b"\0" * (aligned(file.tell()) - file.tell()))
+            file.write(layer.windowBits)
+
+
+class SceneFile:
+    # a scene file mapped into memory, every layer column is a read-only numpy view of the mapping
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self.mapping)
+
+        header = sceneHeader.unpack_from(buffer)
+        magic, version, layerCount, w, h, self.maxBuildingHeight, isSkyDark = header[:7]
+        if magic != sceneMagic:
+            raise ValueError(f"{filename} is not a city scene file")
+        if version != sceneVersion:
+            raise ValueError(f"{filename} is scene format version {version}, only version {sceneVersion} can be read")
+
+        self.size = (w, h)
+        self.isSkyDark = bool(isSkyDark)
+        self.skyHsl = header[7:10]
+        self.skyColor = header[10:13]
+        self.roofLightColor = header[13:16]
+
+        offset = sceneHeader.size
+        colors = np.frombuffer(buffer, dtype=np.uint8, count=layerCount * 3, offset=offset).reshape(layerCount, 3)
+        self.buildingColors = [tuple(int(channel) for channel in color) for color in colors]
+        offset += layerCount * 3
+
+        gaussNext, = struct.unpack_from("<d", buffer, offset)
+        offset += 8
+        rngWords = np.frombuffer(buffer, dtype="<u4", count=rngStateLength, offset=offset)
+        self.rngState = (3, tuple(int(word) for word in rngWords), None if gaussNext != gaussNext else gaussNext)
+        offset += rngStateLength * 4
+
+        entries = []
+        for _ in range(layerCount):
+            entries.append(layerEntry.unpack_from(buffer, offset))
+            offset += layerEntry.size
+
+        self.layers = []
+        for count, windowBytes in entries:
+            columns = {}
+            for name, dtype in layerColumns:
+                offset = aligned(offset)
+                columns[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+                offset += columns[name].nbytes
+            offset = aligned(offset)
+            columns['windowBits'] = np.frombuffer(buffer, dtype=np.uint8, count=windowBytes, offset=offset)
+            offset += windowBytes
+            self.layers.append(columns)
+
+    def buildingLayers(self):
+        # copies the mapped columns into BuildingLayers, one block copy per column
+        layers = []
+        for columns in self.layers:
+            layer = city_generator.BuildingLayer()
+            for name, _ in layerColumns:
+                column = getattr(layer, name)
+                column.frombytes(columns[name].astype(np.dtype(column.typecode).newbyteorder("=")).tobytes())
+            layer.windowBits = bytearray(columns['windowBits'])
+            layers.append(layer)
+        return layers
+
+    def close(self):
+        self.layers = []
+        self.mapping.close()
+
+
+def mapScene(filename):
+    return SceneFile(filename)
+
+
+def loadScene(filename, renderer=None):
+    # a renderer holding the saved scene and the size it was saved for, rendering it at that size never touches random
+    renderer = renderer if renderer is not None else city_generator.CityRenderer()
+    scene = SceneFile(filename)
+    try:
+        renderer.reset()
+        renderer.skyHsl = scene.skyHsl
+        renderer.skyColor = scene.skyColor
+        renderer.buildingColors = scene.buildingColors
+        renderer.updateColorTable()
+        renderer.roofLightColor = scene.roofLightColor
+        renderer.isSkyDark = scene.isSkyDark
+        renderer.maxBuildingHeight = scene.maxBuildingHeight
+        renderer.buildingsData = scene.buildingLayers()
+        renderer.rng.setstate(scene.rngState)
+        size = scene.size
+    finally:
+        scene.close()
+    return renderer, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Save city scenes to files and render them back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    save = commands.add_parser("save", help="generate a seeded scene and save it")
+    save.add_argument("--seed", type=int, default=None, help="seed for the scene, random if not given")
+    save.add_argument("--width", type=int, default=city_generator.width)
+    save.add_argument("--height", type=int, default=city_generator.height)
+    save.add_argument("--output", default="exports/city.cityscene")
+
+    render = commands.add_parser("render", help="render saved scenes to PNGs at the size they were saved for")
+    render.add_argument("scenes", nargs="+")
+    render.add_argument("--output-dir", default="exports")
+    args = parser.parse_args(argv)
+
+    if args.command == "save":
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        saveScene(city_generator.CityRenderer(args.seed), args.output, args.width, args.height)
+        print(f"Saved {args.output} ({os.path.getsize(args.output)} bytes)", file=sys.stderr)
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    startTime = time.perf_counter()
+    for filename in args.scenes:
+        renderer, size = loadScene(filename)
+        img = renderer.generateCityImage(*size)
+        name = os.path.splitext(os.path.basename(filename))[0]
+        img.save(os.path.join(args.output_dir, f"{name}.png"))
+    elapsed = time.perf_counter() - startTime
+    print(f"Rendered {len(args.scenes)} scenes in {elapsed:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import city_generator
+from city_cache import RenderCache, cacheFormats, renderSceneBytes, sceneKey
+
+maxRenderWidth = 8192
+maxRenderHeight = 4320
+renderTimeout = 60  # seconds a request waits for its render before giving up
+streamChunkSize = 64 * 1024
+contentTypes = {'png': "image/png", 'webp': "image/webp", 'raw': "application/octet-stream"}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def warmWorker():
+    # runs once in every worker process, so the first real request doesn't pay for imports and first-call setup
+    renderSceneBytes(0, city_generator.minWidth, city_generator.minHeight)
+
+
+class ServiceMetrics:
+    # request counts, and latencies of the most recent requests for percentiles
+    def __init__(self, window=2048):
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+        self.latencies = deque(maxlen=window)  # (finished at, seconds)
+        self.counts = {'requests': 0, 'bytes': 0}
+        self.statuses = {}
+        self.sources = {}  # cache, render or coalesced
+
+    def record(self, status, seconds, source=None, size=0):
+        with self.lock:
+            self.counts['requests'] += 1
+            self.counts['bytes'] += size
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if source is not None:
+                self.sources[source] = self.sources.get(source, 0) + 1
+            if status == 200:
+                self.latencies.append((time.time(), seconds))
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            latencies = sorted(seconds for _, seconds in self.latencies)
+            lastMinute = sum(1 for finished, _ in self.latencies if now - finished <= 60)
+            uptime = now - self.startTime
+
+            def percentile(fraction):
+                if not latencies:
+                    return None
+                return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+            return {
+                'uptimeSeconds': uptime,
+                'requests': self.counts['requests'],
+                'bytesSent': self.counts['bytes'],
+                'statuses': {str(status): count for status, count in self.statuses.items()},
+                'sources': dict(self.sources),
+                'requestsPerSecond': self.counts['requests'] / uptime if uptime > 0 else 0.0,
+                'servedPerSecondLastMinute': lastMinute / 60,
+                'latencySeconds': {
+                    'p50': percentile(0.5),
+                    'p95': percentile(0.95),
+                    'p99': percentile(0.99),
+                    'max': latencies[-1] if latencies else None,
+                    'samples': len(latencies),
+                },
+            }
+
+
+class RenderService:
+    # renders on a pool of warm worker processes behind the render cache. identical requests that arrive while
+    # one is being rendered wait on the same render, and new renders are refused once maxQueue are in flight
+    def __init__(self, workers=None, maxQueue=32, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.maxQueue = maxQueue
+        self.cache = cache if cache is not None else RenderCache()
+        self.metrics = ServiceMetrics()
+        self.lock = threading.Lock()
+        self.inFlight = {}  # cache key -> future of the render
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warmWorker)
+
+        # start every worker now rather than on the first requests
+        for future in [self.pool.submit(time.sleep, 0.05) for _ in range(self.workers)]:
+            future.result()
+
+    def render(self, seed, w, h, imageFormat):
+        # (bytes, source) where source says whether the cache, a new render or someone else's render served it
+        key = sceneKey(seed, w, h, imageFormat)
+        data = self.cache.get(key)
+        if data is not None:
+            return data, "cache"
+
+        with self.lock:
+            future = self.inFlight.get(key)
+            source = "coalesced"
+            if future is None:
+                if len(self.inFlight) >= self.maxQueue:
+                    raise QueueFull()
+                future = self.pool.submit(renderSceneBytes, seed, w, h, imageFormat)
+                future.add_done_callback(lambda done, key=key: self.finishRender(key, done))
+                self.inFlight[key] = future
+                source = "render"
+
+        return future.result(timeout=renderTimeout), source
+
+    def finishRender(self, key, future):
+        # cached before it leaves inFlight, so a request arriving in between finds it in one or the other
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+        with self.lock:
+            self.inFlight.pop(key, None)
+
+    def queueDepth(self):
+        with self.lock:
+            return len(self.inFlight)
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    service = None  # set by serve()
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/render":
+            self.handleRender(parse_qs(url.query))
+        elif url.path == "/metrics":
+            metrics = self.service.metrics.snapshot()
+            metrics['queueDepth'] = self.service.queueDepth()
+            metrics['maxQueue'] = self.service.maxQueue
+            metrics['workers'] = self.service.workers
+            metrics['cache'] = self.service.cache.statistics()
+            self.sendJson(200, metrics)
+        elif url.path == "/health":
+            self.sendJson(200, {'status': "ok"})
+        else:
+            self.sendJson(404, {'error': f"no endpoint at {url.path}"})
+
+    def handleRender(self, query):
+        startTime = time.perf_counter()
+        try:
+            seed = int(query['seed'][0]) if 'seed' in query else random.getrandbits(32)
+            w = int(query.get('w', [city_generator.width])[0])
+            h = int(query.get('h', [city_generator.height])[0])
+            imageFormat = query.get('format', ["png"])[0]
+        except ValueError:
+            self.sendJson(400, {'error': "seed, w and h must be integers"})
+            return self.service.metrics.record(400, time.perf_counter() - startTime)
+
+        if not (city_generator.minWidth <= w <= maxRenderWidth and city_generator.minHeight <= h <= maxRenderHeight):
+            self.sendJson(400, {'error': f"w must be {city_generator.minWidth}-{maxRenderWidth} and "
+                                         f"h {city_generator.minHeight}-{maxRenderHeight}"})
+            return self.service.metrics.record(400, time.perf_counter() - startTime)
+        if imageFormat not in cacheFormats:
+            self.sendJson(400, {'error': f"format must be one of {', '.join(cacheFormats)}"})
+            return self.service.metrics.record(400, time.perf_counter() - startTime)
+
+        try:
+            data, source = self.service.render(seed, w, h, imageFormat)
+        except QueueFull:
+            # the client should back off and try again rather than pile more work on
+            self.sendJson(503, {'error': "render queue is full"}, {'Retry-After': "1"})
+            return self.service.metrics.record(503, time.perf_counter() - startTime)
+        except TimeoutError:
+            self.sendJson(504, {'error': "render timed out"})
+            return self.service.metrics.record(504, time.perf_counter() - startTime)
+        except Exception as error:
+            # a render that raised, a worker that died or a pool that's shut down, the client still gets a status
+            self.sendJson(500, {'error': f"render failed: {type(error).__name__}"})
+            return self.service.metrics.record(500, time.perf_counter() - startTime)
+
+        headers = {'X-City-Seed': str(seed), 'X-City-Source': source, 'X-Image-Width': str(w), 'X-Image-Height': str(h)}
+        self.sendBody(200, contentTypes[imageFormat], data, headers)
+        self.service.metrics.record(200, time.perf_counter() - startTime, source, len(data))
+
+    def sendJson(self, status, body, headers=None):
+        self.sendBody(status, "application/json", json.dumps(body).encode(), headers)
+
+    def sendBody(self, status, contentType, data, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        # written in chunks so a large image goes out as it's sent rather than copied into one big write
+        view = memoryview(data)
+        try:
+            for offset in range(0, len(view), streamChunkSize):
+                self.wfile.write(view[offset:offset + streamChunkSize])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass  # every request is counted in /metrics instead
+
+
+def serve(host="127.0.0.1", port=8080, workers=None, maxQueue=32, cache=None):
+    service = RenderService(workers, maxQueue, cache)
+    handler = type("ServiceRequestHandler", (RenderRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve city skylines over HTTP on this machine.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="render processes (defaults to the cpu count)")
+    parser.add_argument("--max-queue", type=int, default=32, help="renders in flight before requests are refused")
+    parser.add_argument("--cache-mb", type=int, default=256, help="memory cache size")
+    parser.add_argument("--cache-dir", default=None, help="keep renders on disk here too")
+    parser.add_argument("--disk-mb", type=int, default=2048, help="disk cache size")
+    args = parser.parse_args(argv)
+
+    cache = RenderCache(args.cache_mb * 1024 * 1024, args.cache_dir, args.disk_mb * 1024 * 1024)
+    server, service = serve(args.host, args.port, args.workers, args.max_queue, cache)
+    print(f"Serving on http://{args.host}:{server.server_port} with {service.workers} workers", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
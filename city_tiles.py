@@ -0,0 +1,134 @@
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+import city_generator
+
+
+def writePngChunk(file, chunkType, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(chunkType)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunkType))))
+
+
+def pngScanlines(rows):
+    # every scanline starts with its filter type, 0 leaves the row unfiltered
+    rows = rows.reshape(len(rows), -1)
+    scanlines = np.zeros((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rows
+    return scanlines
+
+
+class PngRowWriter:
+    # writes a png a few rows at a time, so the whole image never has to be held in memory
+    def __init__(self, file, w, h, palette=None, compressLevel=6):
+        # with a palette the png stores one index per pixel, otherwise rows are rgb
+        self.file = file
+        self.compressor = zlib.compressobj(compressLevel)
+        colorType = 3 if palette is not None else 2
+
+        file.write(b"\x89PNG\r\n\x1a\n")
+        self.writeChunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, colorType, 0, 0, 0))
+        if palette is not None:
+            self.writeChunk(b"PLTE", bytes(palette))
+
+    def writeChunk(self, chunkType, data):
+        writePngChunk(self.file, chunkType, data)
+
+    def writeRows(self, rows):
+        data = self.compressor.compress(pngScanlines(rows))
+        if data:
+            self.writeChunk(b"IDAT", data)
+
+    def close(self):
+        self.writeChunk(b"IDAT", self.compressor.flush())
+        self.writeChunk(b"IEND", b"")
+
+
+class RawRowWriter:
+    # headerless pixel rows, top to bottom, for piping into other tools
+    def __init__(self, file):
+        self.file = file
+
+    def writeRows(self, rows):
+        self.file.write(rows.tobytes())
+
+    def close(self):
+        self.file.flush()
+
+
+def exportTiledCity(renderer, w, h, file, tileWidth=2048, imageFormat="png", indexed=False, compressLevel=6):
+    # renders the scene one column tile at a time into a scratch file on disk, then streams it out row by row,
+    # memory use is about one tile plus a tile's worth of output rows however wide the image is
+    renderer.beginRender()
+    renderer.updateScene(w, h)
+    city_generator.checkIndexedHeight(renderer, h, "for a tiled export")
+
+    # every building's random state is settled up front so the image is the same for any tile width
+    renderer.settleBuildings(h)
+    palette = renderer.scenePalette(h)
+    colors = np.array(palette, dtype=np.uint8).reshape(256, 3)
+
+    if imageFormat == "png":
+        writer = PngRowWriter(file, w, h, palette if indexed else None, compressLevel)
+    else:
+        writer = RawRowWriter(file)
+
+    # the scratch file holds one palette index per pixel in row order, it's written and read with
+    # positioned io rather than mapped so the finished image sits in the page cache, not in this process
+    with tempfile.TemporaryFile() as scratch:
+        fd = scratch.fileno()
+
+        for xStart in range(0, w, tileWidth):
+            xEnd = min(w, xStart + tileWidth)
+            tile = renderer.renderIndexTile(xStart, xEnd, h).pixels
+            for y in range(h):
+                os.pwrite(fd, tile[y], y * w + xStart)
+
+        rowsPerChunk = max(1, tileWidth * h // w)
+        for y in range(0, h, rowsPerChunk):
+            count = min(rowsPerChunk, h - y)
+            rows = np.frombuffer(os.pread(fd, count * w, y * w), dtype=np.uint8).reshape(count, w)
+            writer.writeRows(rows if indexed else colors[rows])
+
+    writer.close()
+    renderer.finishRender(w, h)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a very wide city skyline in tiles with bounded memory.")
+    parser.add_argument("--width", type=int, default=100000)
+    parser.add_argument("--height", type=int, default=city_generator.height)
+    parser.add_argument("--seed", type=int, default=None, help="seed for the scene, random if not given")
+    parser.add_argument("--tile-width", type=int, default=2048, help="columns rasterized per tile")
+    parser.add_argument("--format", choices=["png", "raw"], default="png", help="png, or headerless rows")
+    parser.add_argument("--indexed", action="store_true", help="write palette indices instead of rgb pixels")
+    parser.add_argument("--compress-level", type=int, default=6, help="zlib level for png output")
+    parser.add_argument("--output", default="exports/city_wide.png", help="output file, - for stdout")
+    args = parser.parse_args(argv)
+
+    renderer = city_generator.CityRenderer(args.seed)
+    startTime = time.perf_counter()
+
+    if args.output == "-":
+        exportTiledCity(renderer, args.width, args.height, sys.stdout.buffer, args.tile_width,
+                        args.format, args.indexed, args.compress_level)
+    else:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "wb") as file:
+            exportTiledCity(renderer, args.width, args.height, file, args.tile_width,
+                            args.format, args.indexed, args.compress_level)
+
+    elapsed = time.perf_counter() - startTime
+    print(f"Exported {args.width}x{args.height} in {elapsed:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
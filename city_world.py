@@ -0,0 +1,227 @@
+import argparse
+import os
+from collections import OrderedDict
+from random import Random
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import city_generator
+from city_generator import (BuildingLayer, CityRenderer, absoluteMaxBuildingHeight, buildingWidthRange,
+                            layerBaseline, litWindowMask, numLayers, roofLightChance, windowGridSize,
+                            windowStyleWeights, windowStyles)
+from city_gui import convertPixelsToPygame
+
+chunkWidth = 1024
+chunkCacheSize = 8  # rendered chunks kept, a few screens' worth
+chunkLayoutCacheSize = 16
+buildingGapRange = (5, 15)
+scrollSpeed = 600  # px per second while an arrow key is held
+
+
+class SkylineWorld:
+    # an endless skyline split into chunkWidth wide chunks. every layer of a chunk is laid out from its own
+    # rng seeded by (world seed, layer, chunk index), so any chunk can be made without the ones before it
+    def __init__(self, seed, h):
+        self.seed = seed
+        self.height = h
+        self.renderer = CityRenderer(seed)
+        self.renderer.newColors()
+        city_generator.checkIndexedHeight(self.renderer, h, "for a scrolling skyline")
+
+        self.renderer.maxBuildingHeight = min(h - city_generator.minTopClearance - 160, absoluteMaxBuildingHeight)
+        self.palette = self.renderer.scenePalette(h)
+        self.layouts = OrderedDict()  # (layer, chunk) -> BuildingLayer, least recently used first
+
+    def chunkRng(self, layerIndex, chunk):
+        return Random(f"{self.seed}:{layerIndex}:{chunk}")
+
+    def firstBuildingX(self, layerIndex, chunk):
+        # the first draw of a chunk's rng is the gap before its first building, so the chunk to its left can
+        # find out where it has to stop without laying the whole chunk out
+        return chunk * chunkWidth + self.chunkRng(layerIndex, chunk).randint(*buildingGapRange)
+
+    def chunkLayout(self, layerIndex, chunk):
+        # the buildings starting in a chunk, in world coordinates, with their windows and roof lights decided.
+        # the last one may run past the chunk's right edge but always stops short of the next chunk's first building
+        key = (layerIndex, chunk)
+        layer = self.layouts.get(key)
+        if layer is not None:
+            self.layouts.move_to_end(key)
+            return layer
+
+        rng = self.chunkRng(layerIndex, chunk)
+        x = chunk * chunkWidth + rng.randint(*buildingGapRange)
+        limit = self.firstBuildingX(layerIndex, chunk + 1) - buildingGapRange[0]
+
+        maxHeight = min(self.renderer.maxBuildingHeight, absoluteMaxBuildingHeight)
+        minHeight = min(max(50, 30 + layerIndex * 15), maxHeight - 10)
+        if layerIndex == numLayers - 1:
+            maxHeight = min(maxHeight, city_generator.height - 20)
+
+        layer = BuildingLayer()
+        while x < (chunk + 1) * chunkWidth:
+            buildingWidth = min(rng.randint(*buildingWidthRange), limit - x)
+            buildingHeight = rng.randint(minHeight, maxHeight)
+            gap = rng.randint(*buildingGapRange)
+            if buildingWidth < buildingWidthRange[0]:
+                break  # too little room before the next chunk's first building, the gap just gets wider
+            layer.append(x, buildingWidth, buildingHeight, gap)
+            x += buildingWidth + gap
+
+        # windows and roof lights come from the same rng, after the layout
+        yBase = layerBaseline(self.height, layerIndex)
+        for buildingId in range(len(layer)):
+            windowStyle = rng.choices(windowStyles, weights=windowStyleWeights, k=1)[0]
+            layer.style[buildingId] = windowStyles.index(windowStyle)
+            layer.roofLights[buildingId] = int(rng.random() < roofLightChance)
+            totalHeight = self.height - (yBase - layer.height[buildingId])
+            layer.storeWindowLitGrid(buildingId, litWindowMask(rng, *windowGridSize(windowStyle, layer.width[buildingId], totalHeight)))
+
+        self.layouts[key] = layer
+        if len(self.layouts) > chunkLayoutCacheSize:
+            self.layouts.popitem(last=False)
+        return layer
+
+    def chunkLayers(self, chunk):
+        # every layer's buildings that show in a chunk: its own plus any from the chunk to its left that cross into it
+        layers = []
+        for layerIndex in range(numLayers):
+            layer = BuildingLayer()
+            for source in (self.chunkLayout(layerIndex, chunk - 1), self.chunkLayout(layerIndex, chunk)):
+                for buildingId in source.buildingsInRange(chunk * chunkWidth, (chunk + 1) * chunkWidth):
+                    copyBuilding(source, buildingId, layer)
+            layers.append(layer)
+        return layers
+
+    def renderChunk(self, chunk):
+        # (h, chunkWidth) palette indices for one chunk
+        self.renderer.buildingsData = self.chunkLayers(chunk)
+        xStart = chunk * chunkWidth
+        return self.renderer.renderIndexTile(xStart, xStart + chunkWidth, self.height).pixels
+
+
+def copyBuilding(source, buildingId, target):
+    target.append(source.x[buildingId], source.width[buildingId], source.height[buildingId], source.gap[buildingId])
+    index = len(target) - 1
+    target.style[index] = source.style[buildingId]
+    target.roofLights[index] = source.roofLights[buildingId]
+    target.storeWindowLitGrid(index, source.windowLitGrid(buildingId))
+
+
+class ChunkSurfaces:
+    # pygame surfaces of the most recently used chunks, each one wraps its chunk's pixels without a copy
+    def __init__(self, world, size=chunkCacheSize):
+        self.world = world
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.rendered = 0
+
+    def get(self, chunk):
+        surface = self.surfaces.get(chunk)
+        if surface is not None:
+            self.surfaces.move_to_end(chunk)
+            return surface
+
+        surface = convertPixelsToPygame(self.world.renderChunk(chunk), self.world.palette)
+        self.rendered += 1
+        self.surfaces[chunk] = surface
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def has(self, chunk):
+        return chunk in self.surfaces
+
+
+def visibleChunks(cameraX, viewWidth):
+    return range(int(cameraX // chunkWidth), int((cameraX + viewWidth - 1) // chunkWidth) + 1)
+
+
+def drawView(screen, chunks, cameraX):
+    viewWidth = screen.get_width()
+    for chunk in visibleChunks(cameraX, viewWidth):
+        screen.blit(chunks.get(chunk), (round(chunk * chunkWidth - cameraX), 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scroll through an endless city skyline.")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the world, random if not given")
+    parser.add_argument("--width", type=int, default=city_generator.width * 2)
+    parser.add_argument("--height", type=int, default=city_generator.height)
+    args = parser.parse_args(argv)
+    seed = args.seed if args.seed is not None else Random().getrandbits(32)
+    # below the generator's smallest size there's no room left for buildings
+    size = (max(args.width, city_generator.minWidth), max(args.height, city_generator.minHeight))
+
+    pygame.init()
+    pygame.display.set_caption(f"Pixel Art City Skyline (seed {seed})")
+    screen = pygame.display.set_mode(size, pygame.RESIZABLE)
+    clock = pygame.time.Clock()
+
+    world = SkylineWorld(seed, size[1])
+    chunks = ChunkSurfaces(world)
+    cameraX = 0.0
+    heading = 1  # which way the view last moved, the chunk past that edge is rendered ahead of time
+    dragging = False
+    running = True
+    redraw = True
+
+    while running:
+        # while nothing is moving and the chunks either side are ready, sleep until something happens
+        viewChunks = visibleChunks(cameraX, screen.get_width())
+        ahead = viewChunks[-1] + 1 if heading > 0 else viewChunks[0] - 1
+        keys = pygame.key.get_pressed()
+        idle = not (redraw or dragging or keys[pygame.K_LEFT] or keys[pygame.K_RIGHT] or not chunks.has(ahead))
+        events = [pygame.event.wait()] + pygame.event.get() if idle else pygame.event.get()
+        seconds = clock.tick(city_generator.maxFrameRate) / 1000
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEORESIZE:
+                size = (max(event.w, city_generator.minWidth), max(event.h, city_generator.minHeight))
+                if size != (event.w, event.h):
+                    screen = pygame.display.set_mode(size, pygame.RESIZABLE)
+                else:
+                    screen = pygame.display.get_surface()
+                if size[1] != world.height:
+                    # the same seed at a new height, layouts and renders depend on the height
+                    world = SkylineWorld(seed, size[1])
+                    chunks = ChunkSurfaces(world)
+                redraw = True
+            elif event.type == pygame.WINDOWEXPOSED:
+                redraw = True
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                dragging = True
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                dragging = False
+            elif event.type == pygame.MOUSEMOTION and dragging and event.rel[0]:
+                cameraX -= event.rel[0]
+                heading = -1 if event.rel[0] > 0 else 1
+                redraw = True
+
+        keys = pygame.key.get_pressed()
+        direction = keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]
+        if direction:
+            cameraX += direction * scrollSpeed * seconds
+            heading = direction
+            redraw = True
+
+        if redraw:
+            drawView(screen, chunks, cameraX)
+            pygame.display.flip()
+            redraw = False
+
+        # at most one chunk ahead is rendered a frame, so it's ready before it scrolls into view
+        viewChunks = visibleChunks(cameraX, screen.get_width())
+        ahead = viewChunks[-1] + 1 if heading > 0 else viewChunks[0] - 1
+        if not chunks.has(ahead):
+            chunks.get(ahead)
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()